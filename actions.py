@@ -0,0 +1,137 @@
+import random
+
+from keyboards import get_main_kb, inventory_inline_kb, character_inline_kb, menu_kb
+from crafts import BOOK, CRAFT_MENU_LIMIT, handle_craft
+from stories import ENGINE, handle_story
+from router import CallbackRouter, ScreenRegistry
+
+router = CallbackRouter()
+screens = ScreenRegistry(default="main")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ЭКРАНЫ
+# ──────────────────────────────────────────────────────────────────────────────
+@screens.screen("main")
+def main_screen(game):
+    return game.get_ui(), get_main_kb(game)
+
+@screens.screen("inventory")
+def inventory_screen(game):
+    return game.get_inventory_text(), inventory_inline_kb
+
+@screens.screen("character")
+def character_screen(game):
+    return game.get_character_text(), character_inline_kb
+
+@screens.screen("craft")
+def craft_screen(game):
+    recipes = BOOK.available(game, CRAFT_MENU_LIMIT)
+    if recipes:
+        items = tuple((r.title, f"craft_{r.id}") for r in recipes)
+        return "Доступный крафт:", menu_kb(items)
+    hint = BOOK.hint()
+    return "Пока ничего нельзя скрафтить." + (f"\n({hint})" if hint else ""), menu_kb(())
+
+@screens.screen("use")
+def use_screen(game):
+    items = []
+    if game.inventory.get("Факел", 0) > 0 and game.equipment["hand"] is None:
+        items.append(("Факел ", "use_item_Факел"))
+    if not items:
+        items.append(("Нечего использовать", "dummy"))
+    return "Что использовать?", menu_kb(tuple(items))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАВИГАЦИЯ
+# ──────────────────────────────────────────────────────────────────────────────
+NAV_CALLBACKS = {
+    "action_2": "inventory",
+    "inv_character": "character",
+    "inv_craft": "craft",
+    "inv_use": "use",
+}
+
+@router.callback(*NAV_CALLBACKS)
+def open_screen(data, game, uid):
+    name = NAV_CALLBACKS[data]
+    game.push_screen(name)
+    return screens.render(name, game)
+
+@router.callback("back")
+def back(data, game, uid):
+    return screens.render(game.pop_screen(), game)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# КРАФТ И ИСТОРИИ
+# ──────────────────────────────────────────────────────────────────────────────
+@router.prefix("craft_")
+@router.prefix("use_item_")
+def craft_or_use(data, game, uid):
+    text, kb = handle_craft(data, game, uid)
+    if text is None:
+        return screens.render("inventory", game)
+    return text, kb
+
+@router.callback(*ENGINE.callbacks)
+def story(data, game, uid):
+    return handle_story(data, game, uid)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ДЕЙСТВИЯ
+# ──────────────────────────────────────────────────────────────────────────────
+EXPLORE_FINDS = ["Ветка", "Камень", "Ягода", "Гриб"]
+STAT_MAX = 100  # потолок здоровья и воды
+DAY_AP = 5  # очков действий на день
+DRINK_THIRST = 30  # вода за глоток
+SLEEP_HP = 40  # здоровье за ночь
+SLEEP_HUNGER = 20  # сытость, потраченная за ночь
+SLEEP_THIRST = 15  # вода, потраченная за ночь
+RAIN_WATER = 5  # воды за один сбор под дождём
+
+@router.callback("action_1")
+def explore(data, game, uid):
+    if game.ap <= 0:
+        game.add_log("Действия на сегодня закончились.")
+    else:
+        game.ap -= 1
+        found = random.choice(EXPLORE_FINDS)
+        game.inventory[found] += 1
+        game.add_log(f"Нашёл: {found}")
+    return screens.render("main", game)
+
+@router.callback("action_3")
+def drink(data, game, uid):
+    if game.ap <= 0:
+        game.add_log("Действия на сегодня закончились.")
+    elif game.inventory["Бутылка воды"] > 0:
+        game.inventory["Бутылка воды"] -= 1
+        game.thirst = min(STAT_MAX, game.thirst + DRINK_THIRST)
+        game.add_log("Ты сделал глоток воды. Жажда уменьшилась.")
+    else:
+        game.add_log("Воды больше нет.")
+    return screens.render("main", game)
+
+@router.callback("action_4")
+def sleep(data, game, uid):
+    if game.ap <= 0:
+        game.add_log("Действия на сегодня закончились.")
+    else:
+        game.hp = min(STAT_MAX, game.hp + SLEEP_HP)
+        game.hunger = max(0, game.hunger - SLEEP_HUNGER)
+        game.thirst = max(0, game.thirst - SLEEP_THIRST)
+        game.day += 1
+        game.ap = DAY_AP
+        game.add_log("Ты уснул. Новый день начался.")
+    return screens.render("main", game)
+
+@router.callback("action_collect_water")
+def collect_water(data, game, uid):
+    if game.weather == "rain" and game.inventory["Бутылка воды"] < game.water_capacity:
+        add = min(RAIN_WATER, game.water_capacity - game.inventory["Бутылка воды"])
+        game.inventory["Бутылка воды"] += add
+        game.add_log(f"Собрал {add} воды в бутылку.")
+    return screens.render("main", game)
@@ -0,0 +1,82 @@
+"""Бенчмарк меню крафта на большом наборе рецептов.
+
+Генерирует N синтетических рецептов и меряет время открытия меню крафта
+после типичного действия (одна находка в инвентаре): инкрементальный
+пересчёт по индексу ингредиентов против полного перебора.
+
+Инкрементальная стоимость зависит не от общего числа рецептов, а от того,
+во скольких рецептах участвует изменившийся предмет. Поэтому пул предметов
+растёт вместе с книгой так, чтобы на предмет приходилось ~--fanout рецептов
+(при --fanout 0 пул фиксирован — видно, как растёт цена «популярного» предмета).
+
+    python benchmarks/bench_crafts.py [--recipes 1000 5000 20000] [--fanout 6]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import actions  # noqa: E402
+from crafts import CraftBook  # noqa: E402
+from game import Game  # noqa: E402
+
+BASE_ITEMS = ["Ветка", "Камень", "Ягода", "Гриб", "Спички "]
+INGREDIENTS_PER_RECIPE = 3  # в среднем
+
+
+def make_items(n: int, fanout: int) -> list[str]:
+    pool = 500 if not fanout else max(500, n * INGREDIENTS_PER_RECIPE // fanout)
+    return [f"Предмет {i}" for i in range(pool)] + BASE_ITEMS
+
+
+def make_book(n: int, items: list[str], rng: random.Random) -> CraftBook:
+    recipes = []
+    for i in range(n):
+        ingredients = {item: rng.randint(1, 3) for item in rng.sample(items, rng.randint(2, 4))}
+        recipes.append({"id": f"r{i}", "title": f"Рецепт {i}", "ingredients": ingredients})
+    return CraftBook(recipes)
+
+
+def make_game(items: list[str], rng: random.Random) -> Game:
+    game = Game()
+    for item in rng.sample(items, len(items) * 2 // 5):
+        game.inventory[item] = rng.randint(0, 5)
+    return game
+
+
+def bench(book: CraftBook, items: list[str], rounds: int, incremental: bool, rng: random.Random) -> float:
+    actions.BOOK = book
+    game = make_game(items, rng)
+    actions.screens.render("craft", game)  # первый полный расчёт
+    total = 0
+    for _ in range(rounds):
+        game.inventory[rng.choice(items)] += 1  # как action_1: одна находка
+        if not incremental:
+            game._craftable = None
+        start = time.perf_counter_ns()
+        actions.screens.render("craft", game)
+        total += time.perf_counter_ns() - start
+    return total / rounds / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipes", type=int, nargs="+", default=[1, 1000, 5000, 20000])
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--fanout", type=int, default=6)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    print(f"{'рецептов':>9} {'инкрементально, мкс':>21} {'полный перебор, мкс':>21}")
+    for n in args.recipes:
+        items = make_items(n, args.fanout)
+        book = make_book(n, items, rng)
+        inc = bench(book, items, args.rounds, True, rng)
+        full = bench(book, items, max(args.rounds // 10, 10), False, rng)
+        print(f"{n:>9} {inc:>21.1f} {full:>21.1f}")
+
+
+if __name__ == "__main__":
+    main()
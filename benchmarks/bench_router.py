@@ -0,0 +1,79 @@
+"""Микро-бенчмарк маршрутизации callback'ов.
+
+Меряет стоимость router.resolve() на апдейт и полный вызов обработчика
+(resolve + изменение Game + рендер экрана), а также как resolve ведёт себя,
+если зарегистрировать ещё сотни действий.
+
+    python benchmarks/bench_router.py [--n 200000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions import router  # noqa: E402
+from game import Game  # noqa: E402
+from router import CallbackRouter  # noqa: E402
+
+CALLBACKS = [
+    "action_1", "action_2", "back", "inv_craft", "back", "inv_use", "back",
+    "inv_character", "back", "back", "action_3", "craft_Факел", "story_next", "unknown",
+]
+
+
+def per_call_ns(fn, n: int) -> float:
+    start = time.perf_counter_ns()
+    fn(n)
+    return (time.perf_counter_ns() - start) / n
+
+
+def bench_resolve(r: CallbackRouter, n: int) -> float:
+    data = CALLBACKS
+
+    def run(count):
+        resolve = r.resolve
+        for i in range(count):
+            resolve(data[i % len(data)])
+    return per_call_ns(run, n)
+
+
+def bench_dispatch(n: int) -> float:
+    data = CALLBACKS
+    game = Game()
+
+    def run(count):
+        for i in range(count):
+            item = data[i % len(data)]
+            handler = router.resolve(item)
+            if handler:
+                handler(item, game, 1)
+            if game.ap <= 0:
+                game.ap = 5
+    return per_call_ns(run, n)
+
+
+def big_router(extra: int) -> CallbackRouter:
+    r = CallbackRouter()
+    for name in set(CALLBACKS):
+        r.callback(name)(lambda *a: None)
+    for i in range(extra):
+        r.callback(f"extra_action_{i}")(lambda *a: None)
+    r.prefix("craft_")(lambda *a: None)
+    r.prefix("use_item_")(lambda *a: None)
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=200_000)
+    args = parser.parse_args()
+    print(f"resolve, текущий набор:      {bench_resolve(router, args.n):8.1f} нс/апдейт")
+    for extra in (100, 1000, 10000):
+        print(f"resolve, +{extra:<5} действий:     {bench_resolve(big_router(extra), args.n):8.1f} нс/апдейт")
+    print(f"resolve + обработчик + рендер: {bench_dispatch(args.n // 10):8.1f} нс/апдейт")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Нагрузочный тест всего конвейера вебхука без сети.
+
+Синтетические игроки шлют /start и сценарий нажатий (исследование,
+инвентарь, крафт, ветки историй) в POST вебхука через ASGI-транспорт httpx.
+Bot API подменён фейковой сессией aiogram, MongoDB — репозиторием в памяти.
+Каждый игрок ждёт обработки своего апдейта и только потом нажимает дальше,
+как живой человек.
+
+Латентность апдейта — от начала POST до конца обработчика в пуле воркеров.
+Ещё считаются апдейты в секунду и вызовы Mongo / Telegram на апдейт.
+Результат пишется в JSON, чтобы сравнивать прогоны между релизами.
+
+    python benchmarks/bench_webhook.py [--users 200] [--rounds 3] [--api-latency-ms 0] [--out bench_webhook.json]
+
+Лимиты антиспама и исходящей очереди по умолчанию подняты, чтобы мерить сам
+конвейер. Чтобы мерить с боевыми лимитами, задайте THROTTLE_RATE,
+SEND_GLOBAL_RATE и т.п. в окружении явно.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("TOKEN", "123456:bench")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:1")
+os.environ.setdefault("STATE_BACKEND", "memory")
+for name, value in (("THROTTLE_RATE", "1000"), ("THROTTLE_BURST", "1000"),
+                    ("SEND_GLOBAL_RATE", "100000"), ("SEND_GLOBAL_BURST", "100000"),
+                    ("SEND_CHAT_RATE", "100000"), ("SEND_CHAT_BURST", "100000"),
+                    ("SAVE_MAX_DELAY", "0.5"), ("WORLD_TICK_INTERVAL", "0")):
+    os.environ.setdefault(name, value)
+
+import httpx  # noqa: E402
+from aiogram import methods  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Chat, Message  # noqa: E402
+
+import main  # noqa: E402
+from storage import PlayerRepository  # noqa: E402
+
+SCRIPT = [
+    "action_1", "action_2", "inv_craft", "back", "inv_character", "back", "back",
+    "action_3", "wolf_fight", "peek_den", "cat_take", "story_next", "action_1", "action_4",
+]
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ПОДМЕНЫ TELEGRAM И MONGODB
+# ──────────────────────────────────────────────────────────────────────────────
+class FakeBotSession(BaseSession):
+    """Отвечает на вызовы Bot API без сети, с опциональной задержкой."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._ids = itertools.count(100000)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, methods.SendMessage):
+            return Message(message_id=next(self._ids), date=datetime.datetime.now(),
+                           chat=Chat(id=method.chat_id, type="private"), text=method.text)
+        return True
+
+
+class MemoryPlayerRepository(PlayerRepository):
+    """Документы игроков в словаре; считает обращения как к MongoDB."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs = {}
+        self.calls = Counter()
+
+    async def _wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def ping(self):
+        self.calls["ping"] += 1
+
+    async def load(self, uid: int) -> dict | None:
+        self.calls["find_one"] += 1
+        await self._wait()
+        return self.docs.get(uid)
+
+    async def update(self, uid: int, update: dict, version: int) -> bool:
+        return not await self.update_many([(uid, update, version)])
+
+    async def update_many(self, items: list[tuple[int, dict, int]]) -> list[int]:
+        self.calls["bulk_write"] += 1
+        self.calls["bulk_write_docs"] += len(items)
+        await self._wait()
+        conflicts = []
+        for uid, update, version in items:
+            doc = self.docs.setdefault(uid, {"_id": uid})
+            if doc.get("v", 0) != version:
+                conflicts.append(uid)
+                continue
+            doc["v"] = version + 1
+            for path, value in update.get("$set", {}).items():
+                doc[path] = value  # структура документа для бенчмарка не важна
+        return conflicts
+
+    async def versions(self, uids: list[int]) -> dict[int, int]:
+        self.calls["find"] += 1
+        await self._wait()
+        return {uid: self.docs[uid].get("v", 0) for uid in uids if uid in self.docs}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# СИНТЕТИЧЕСКИЕ АПДЕЙТЫ
+# ──────────────────────────────────────────────────────────────────────────────
+def start_update(update_id: int, uid: int) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": "/start",
+        "chat": {"id": uid, "type": "private"},
+        "from": {"id": uid, "is_bot": False, "first_name": "bench"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }}
+
+
+def callback_update(update_id: int, uid: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "data": data,
+        "from": {"id": uid, "is_bot": False, "first_name": "bench"},
+        "message": {"message_id": 1, "date": 0, "text": "-", "chat": {"id": uid, "type": "private"}},
+    }}
+
+
+async def skip():
+    pass
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ПРОГОН
+# ──────────────────────────────────────────────────────────────────────────────
+async def run(args) -> dict:
+    session = FakeBotSession(args.api_latency_ms / 1000)
+    repo = MemoryPlayerRepository(args.db_latency_ms / 1000)
+    main.bot.session = session
+    main.repo = repo
+    main.saver.repo = repo
+    # Сводка рейтинга живёт только в настоящей MongoDB
+    main.saver.after_write = None
+    main.leaderboard.ensure_indexes = skip
+
+    started = {}
+    finished = {}
+    latencies = []
+    handle = main.updates.handler
+
+    async def timed_handler(update):
+        try:
+            await handle(update)
+        finally:
+            latencies.append(time.perf_counter() - started.pop(update.update_id))
+            event = finished.pop(update.update_id, None)
+            if event:
+                event.set()
+
+    main.updates.handler = timed_handler
+    await main.on_startup()
+    while not main.is_ready():
+        await asyncio.sleep(0.01)
+
+    ids = itertools.count(1)
+    ack = []
+    rejected = 0
+    headers = {"X-Telegram-Bot-Api-Secret-Token": main.TOKEN}
+    transport = httpx.ASGITransport(app=main.app)
+
+    async def post(client, payload: dict):
+        nonlocal rejected
+        update_id = payload["update_id"]
+        done = finished[update_id] = asyncio.Event()
+        started[update_id] = t0 = time.perf_counter()
+        response = await client.post(main.WEBHOOK_PATH, json=payload, headers=headers)
+        ack.append(time.perf_counter() - t0)
+        if response.status_code != 200:
+            rejected += 1
+            started.pop(update_id, None)
+            finished.pop(update_id, None)
+            return
+        await done.wait()
+
+    async def player(client, uid: int):
+        await post(client, start_update(next(ids), uid))
+        await post(client, callback_update(next(ids), uid, "start_new_game"))
+        for _ in range(args.rounds):
+            for data in SCRIPT:
+                await post(client, callback_update(next(ids), uid, data))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        begin = time.perf_counter()
+        await asyncio.gather(*(player(client, 1_000_000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - begin
+
+    processed = len(latencies)
+    await main.on_shutdown()  # досылает очередь Telegram и сбрасывает сохранения
+
+    telegram_calls = sum(session.calls.values())
+    mongo_calls = sum(v for k, v in repo.calls.items() if k not in ("ping", "bulk_write_docs"))
+    ms = [x * 1000 for x in latencies]
+    ack_ms = [x * 1000 for x in ack]
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {
+            "users": args.users, "rounds": args.rounds, "script": SCRIPT,
+            "api_latency_ms": args.api_latency_ms, "db_latency_ms": args.db_latency_ms,
+            "concurrency": main.updates.concurrency,
+        },
+        "updates": processed,
+        "rejected": rejected,
+        "failed": main.updates.failed,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(processed / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ms, 50), 3),
+            "p95": round(percentile(ms, 95), 3),
+            "p99": round(percentile(ms, 99), 3),
+            "max": round(max(ms, default=0.0), 3),
+        },
+        "ack_latency_ms": {
+            "p50": round(percentile(ack_ms, 50), 3),
+            "p99": round(percentile(ack_ms, 99), 3),
+        },
+        "telegram": {
+            "calls": dict(session.calls),
+            "per_update": round(telegram_calls / processed, 3) if processed else 0.0,
+        },
+        "mongo": {
+            "calls": dict(repo.calls),
+            "per_update": round(mongo_calls / processed, 3) if processed else 0.0,
+        },
+        "sessions": main.games.stats(),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3, help="сколько раз каждый игрок проходит сценарий")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="задержка фейкового Bot API")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="задержка фейковой MongoDB")
+    parser.add_argument("--out", default="bench_webhook.json")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    result = asyncio.run(run(args))
+    logging.disable(logging.NOTSET)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    lat = result["latency_ms"]
+    print(f"апдейтов:           {result['updates']} (отклонено {result['rejected']}, ошибок {result['failed']})")
+    print(f"пропускная способн.: {result['updates_per_s']:.1f} апдейтов/с")
+    print(f"латентность, мс:    p50 {lat['p50']:.2f}  p95 {lat['p95']:.2f}  p99 {lat['p99']:.2f}")
+    print(f"Telegram на апдейт: {result['telegram']['per_update']:.2f}  {result['telegram']['calls']}")
+    print(f"Mongo на апдейт:    {result['mongo']['per_update']:.3f}  {result['mongo']['calls']}")
+    print(f"результат записан в {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
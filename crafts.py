@@ -1,17 +1,115 @@
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from keyboards import inventory_inline_kb  # Import for back kb
+import json
+import os
+from bisect import bisect_left
 
+from keyboards import get_main_kb, inventory_inline_kb
+
+RECIPES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "recipes.json")
+CRAFT_MENU_LIMIT = 30  # кнопок крафта в одном меню
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# РЕЦЕПТЫ
+# ──────────────────────────────────────────────────────────────────────────────
+class Recipe:
+    __slots__ = ("id", "order", "title", "hint", "ingredients", "result", "log")
+
+    def __init__(self, order: int, data: dict):
+        self.id = data["id"]
+        self.order = order
+        self.title = data.get("title", self.id)
+        self.hint = data.get("hint")
+        self.ingredients = tuple(data["ingredients"].items())
+        self.result = tuple(data.get("result", {self.id: 1}).items())
+        self.log = tuple(data.get("log", ()))
+        if not self.ingredients:
+            raise ValueError(f"рецепт {self.id!r} без ингредиентов")
+        for item, count in self.ingredients + self.result:
+            if not isinstance(count, int) or count <= 0:
+                raise ValueError(f"рецепт {self.id!r}: количество {item!r} должно быть > 0")
+
+    def can_craft(self, inventory) -> bool:
+        for item, count in self.ingredients:
+            if inventory.get(item, 0) < count:
+                return False
+        return True
+
+
+class CraftBook:
+    """Набор рецептов с обратным индексом «ингредиент -> рецепты».
+
+    Список доступного крафта хранится в игре и пересчитывается только
+    для рецептов, чьи ингредиенты менялись с прошлого запроса.
+    """
+
+    def __init__(self, recipes: list[dict]):
+        self.recipes = {}
+        self.ordered = []
+        self.by_ingredient = {}
+        for order, data in enumerate(recipes):
+            recipe = Recipe(order, data)
+            if recipe.id in self.recipes:
+                raise ValueError(f"рецепт {recipe.id!r} объявлен дважды")
+            self.recipes[recipe.id] = recipe
+            self.ordered.append(recipe)
+            for item, _ in recipe.ingredients:
+                self.by_ingredient.setdefault(item, []).append(recipe)
+
+    @classmethod
+    def load(cls, path: str = RECIPES_PATH) -> "CraftBook":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def available(self, game, limit: int | None = None) -> list[Recipe]:
+        inventory = game.inventory
+        craftable = game._craftable  # отсортированный список Recipe.order
+        if craftable is None or inventory.touched is None:
+            craftable = [r.order for r in self.ordered if r.can_craft(inventory)]
+        else:
+            for item in inventory.touched:
+                for recipe in self.by_ingredient.get(item, ()):
+                    i = bisect_left(craftable, recipe.order)
+                    present = i < len(craftable) and craftable[i] == recipe.order
+                    if recipe.can_craft(inventory):
+                        if not present:
+                            craftable.insert(i, recipe.order)
+                    elif present:
+                        del craftable[i]
+        inventory.touched = set()
+        game._craftable = craftable
+        return [self.ordered[o] for o in (craftable if limit is None else craftable[:limit])]
+
+    def craft(self, game, recipe_id: str) -> bool:
+        recipe = self.recipes.get(recipe_id)
+        if recipe is None or not recipe.can_craft(game.inventory):
+            return False
+        for item, count in recipe.ingredients:
+            game.inventory[item] -= count
+        for item, count in recipe.result:
+            game.inventory[item] += count
+        for line in recipe.log:
+            game.add_log(line)
+        return True
+
+    def hint(self) -> str | None:
+        for recipe in self.recipes.values():
+            if recipe.hint:
+                return recipe.hint
+        return None
+
+
+BOOK = CraftBook.load()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ОБРАБОТЧИК
+# ──────────────────────────────────────────────────────────────────────────────
 def handle_craft(data, game, uid):
     text = None
     kb = None
-    if data == "craft_Факел":
-        if game.inventory.get("Спички 🔥", 0) < 1 or game.inventory.get("Ветка", 0) < 1:
+    if data.startswith("craft_"):
+        if not BOOK.craft(game, data[len("craft_"):]):
             return None, None  # Handled in main with answer
-        game.inventory["Спички 🔥"] -= 1
-        game.inventory["Ветка"] -= 1
-        game.inventory["Факел"] = game.inventory.get("Факел", 0) + 1
-        game.add_log("Вы скрафтили факел.")
-        game.add_log("Для крафта факела вам пришлось использовать носок с левой ноги.")
         text = game.get_inventory_text()
         kb = inventory_inline_kb
     elif data == "use_item_Факел":
@@ -20,7 +118,7 @@ def handle_craft(data, game, uid):
             game.equipment["hand"] = "Факел"
             game.add_log("Вы экипировали факел в руку.")
             text = game.get_ui()
-            kb = get_main_kb(game)  # Assuming get_main_kb is imported or available
+            kb = get_main_kb(game)
         else:
             game.add_log("Нельзя экипировать факел сейчас.")
             text = game.get_ui()
@@ -0,0 +1,238 @@
+import logging
+import sys
+from collections import Counter
+
+# ──────────────────────────────────────────────────────────────────────────────
+# СХЕМА СОСТОЯНИЯ
+# ──────────────────────────────────────────────────────────────────────────────
+LOG_LIMIT = 20
+SCHEMA_VERSION = 2  # 1 — старые документы без поля schema
+
+EQUIPMENT_SLOTS = ("head", "torso", "back", "pants", "boots", "trinket", "pet", "hand")
+
+# Скалярные поля: имя -> (допустимые типы, значение по умолчанию)
+SCALAR_FIELDS = {
+    "hp": (int, 100),
+    "hunger": (int, 20),
+    "thirst": (int, 60),
+    "ap": (int, 5),
+    "karma": (int, 0),
+    "karma_goal": (int, 100),
+    "day": (int, 1),
+    "weather": (str, "clear"),
+    "location": (str, "лес"),
+    "water_capacity": (int, 10),
+    "story_state": ((str, type(None)), None),
+    "found_branch_once": (bool, False),
+    "world_tick": (int, 0),  # последний применённый тик мира (см. world.py)
+}
+
+START_LOG = ("Ты проснулся в лесу. Что будешь делать?",)
+START_INVENTORY = {
+    "Спички ": 1,
+    "Вилка ": 1,
+    "Кусок коры ": 1,
+    "Сухпай": 3,
+    "Бутылка воды": 10
+}
+START_LOCATIONS = ("лес", "тёмный лес", "озеро", "заброшенный лагерь")
+
+# Миграции: версия -> функция(dict) -> dict следующей версии
+MIGRATIONS = {}
+
+def migration(from_version: int):
+    def decorator(fn):
+        MIGRATIONS[from_version] = fn
+        return fn
+    return decorator
+
+@migration(1)
+def _migrate_v1(data: dict) -> dict:
+    # В старых сохранениях могло не быть стека навигации
+    data.setdefault("nav_stack", ["main"])
+    return data
+
+def item_id(name: str) -> str:
+    # Названия предметов повторяются у всех игроков — держим одну копию строки
+    return sys.intern(name)
+
+
+class Inventory(Counter):
+    """Counter, запоминающий, какие предметы менялись (для пересчёта крафта).
+
+    touched=None — изменения неизвестны, нужен полный пересчёт.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.touched = None
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if self.touched is not None:
+            self.touched.add(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if self.touched is not None:
+            self.touched.add(key)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# КЛАСС ИГРЫ
+# ──────────────────────────────────────────────────────────────────────────────
+class Game:
+    __slots__ = (
+        *SCALAR_FIELDS, "log", "inventory", "unlocked_locations", "equipment", "nav_stack",
+        # отслеживание изменений для дельта-сохранений и кэш рендера
+        "_saved", "_version", "_unconfirmed", "_log_new", "_log_version", "_ui_cache", "_craftable",
+    )
+
+    def __init__(self):
+        for name, (_, default) in SCALAR_FIELDS.items():
+            setattr(self, name, default)
+        self.log = list(START_LOG)
+        self.inventory = Inventory({item_id(k): v for k, v in START_INVENTORY.items()})
+        self.unlocked_locations = list(START_LOCATIONS)
+        self.equipment = dict.fromkeys(EQUIPMENT_SLOTS)
+        self.nav_stack = ["main"]  # стек навигации
+        self._saved = None  # состояние, которое сейчас лежит в базе (None — неизвестно)
+        self._version = 0  # версия документа в базе, от которой считается _saved
+        self._unconfirmed = None  # запись, оборвавшаяся ошибкой: (состояние, строк лога, версия)
+        self._log_new = 0  # строк лога добавлено после последнего сохранения
+        self._log_version = 0  # растёт при каждой записи в лог
+        self._ui_cache = None  # (ключ состояния, готовый текст get_ui)
+        self._craftable = None  # доступные рецепты для крафта (None — не считали)
+
+    def add_log(self, text):
+        # Ограничиваем на месте: список из 20 строк заметно легче deque(maxlen=20)
+        self.log.append(text)
+        if len(self.log) > LOG_LIMIT:
+            del self.log[0]
+        self._log_new += 1
+        self._log_version += 1
+
+    # ── сериализация ─────────────────────────────────────────────────────────
+    def encode(self) -> dict:
+        data = {name: getattr(self, name) for name in SCALAR_FIELDS}
+        data["log"] = list(self.log)
+        data["inventory"] = dict(self.inventory)
+        data["unlocked_locations"] = list(self.unlocked_locations)
+        data["equipment"] = dict(self.equipment)
+        data["nav_stack"] = list(self.nav_stack)
+        data["schema"] = SCHEMA_VERSION
+        return data
+
+    snapshot = encode
+
+    @classmethod
+    def decode(cls, data: dict) -> "Game":
+        """Собирает игру из game_data, прогоняя миграции и проверяя типы полей.
+
+        Поле неподходящего типа заменяется значением по умолчанию — чтобы одна
+        битая запись не стоила игроку всего сохранения.
+        """
+        version = data.get("schema", 1)
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"схема сохранения {version} новее поддерживаемой {SCHEMA_VERSION}")
+        data = dict(data)
+        while version < SCHEMA_VERSION:
+            data = MIGRATIONS[version](data)
+            version += 1
+        game = cls.__new__(cls)
+        for name, (types, default) in SCALAR_FIELDS.items():
+            value = data.get(name, default)
+            if not isinstance(value, types) or (types is int and isinstance(value, bool)):
+                logging.warning(f"Поле {name}={value!r} не подходит по типу, взято значение по умолчанию")
+                value = default
+            setattr(game, name, value)
+        log = data.get("log")
+        game.log = [str(line) for line in log[-LOG_LIMIT:]] if isinstance(log, list) else list(START_LOG)
+        inventory = data.get("inventory")
+        if isinstance(inventory, dict):
+            game.inventory = Inventory({item_id(k): v for k, v in inventory.items() if isinstance(v, int)})
+        else:
+            game.inventory = Inventory({item_id(k): v for k, v in START_INVENTORY.items()})
+        locations = data.get("unlocked_locations")
+        if isinstance(locations, list):
+            game.unlocked_locations = [item_id(x) for x in locations if isinstance(x, str)]
+        else:
+            game.unlocked_locations = list(START_LOCATIONS)
+        game.equipment = dict.fromkeys(EQUIPMENT_SLOTS)
+        equipment = data.get("equipment")
+        if isinstance(equipment, dict):
+            for slot, item in equipment.items():
+                game.equipment[slot] = item_id(item) if isinstance(item, str) else None
+        nav_stack = data.get("nav_stack")
+        game.nav_stack = [str(x) for x in nav_stack] if isinstance(nav_stack, list) and nav_stack else ["main"]
+        game._saved = None
+        game._version = 0
+        game._unconfirmed = None
+        game._log_new = 0
+        game._log_version = 0
+        game._ui_cache = None
+        game._craftable = None
+        return game
+
+    def adopt(self, data: dict):
+        """Заменяет состояние игры на месте: объект могут держать кэш и обработчики."""
+        fresh = Game.decode(data)
+        for name in (*SCALAR_FIELDS, "log", "inventory", "unlocked_locations", "equipment", "nav_stack"):
+            setattr(self, name, getattr(fresh, name))
+        self._log_version += 1
+        self._ui_cache = None
+        self._craftable = None
+
+    def push_screen(self, screen: str):
+        self.nav_stack.append(screen)
+
+    def pop_screen(self):
+        if len(self.nav_stack) > 1:
+            self.nav_stack.pop()
+        return self.nav_stack[-1]
+
+    def reset_nav(self):
+        self.nav_stack = ["main"]
+
+    def get_ui(self):
+        # Текст зависит только от этих полей и лога — пересобираем при их изменении
+        key = (self.hp, self.hunger, self.thirst, self.ap, self.weather, self.day, self._log_version)
+        if self._ui_cache is not None and self._ui_cache[0] == key:
+            return self._ui_cache[1]
+        weather_icon = {"clear": " ", "cloudy": " ", "rain": " "}.get(self.weather, " ")
+        text = (
+            f" {self.hp}    {self.hunger}    {self.thirst}    {self.ap}    {weather_icon} {self.day}\n"
+            "━━━━━━━━━━━━━━━━━━━\n"
+            + "\n".join(f"> {line}" for line in self.log) + "\n"
+            "━━━━━━━━━━━━━━━━━━━"
+        )
+        self._ui_cache = (key, text)
+        return text
+
+    def get_inventory_text(self):
+        lines = []
+        equipped_hand = self.equipment.get("hand")
+        for item, count in self.inventory.items():
+            if count > 0:
+                marker = " " if item == "Факел" else ""
+                equipped_mark = " " if item == equipped_hand else ""
+                line = f"• {item} x{count}{marker}{equipped_mark}" if count > 1 else f"• {item}{marker}{equipped_mark}"
+                lines.append(line)
+        text = "Инвентарь:\n" + "\n".join(lines) if lines else "Инвентарь пуст"
+        text += "\n━━━━━━━━━━━━━━━━━━━"
+        return text
+
+    def get_character_text(self):
+        pet_text = f"Питомец: {self.equipment['pet']}" if self.equipment.get("pet") else "Питомец: Пусто"
+        slots = {
+            "head": "Голова",
+            "torso": "Торс",
+            "back": "Спина",
+            "pants": "Штаны",
+            "boots": "Ботинки",
+            "trinket": "Безделушка",
+            "pet": pet_text,
+            "hand": "Рука"
+        }
+        lines = [f"{name}: {self.equipment.get(slot) or 'Пусто'}" for slot, name in slots.items()]
+        return "Персонаж:\n\n" + "\n".join(lines)
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from storage import MongoPlayerRepository, PlayerRepository
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+# document — игрок хранится одним документом, journal — журнал событий + снапшоты
+PERSISTENCE_MODE = os.getenv("PERSISTENCE_MODE", "document")
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "50"))  # событий между снапшотами
+# Сколько хранить события, уже вошедшие в снапшот (для отладки и аналитики)
+JOURNAL_RETENTION_DAYS = float(os.getenv("JOURNAL_RETENTION_DAYS", "30"))
+JOURNAL_ACTIONS_PENDING = 10000  # игроков с действиями, ждущими записи
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ОПЕРАЦИИ СОБЫТИЯ
+# ──────────────────────────────────────────────────────────────────────────────
+# Событие хранит не update-документ Mongo (ключи с точками и $ в данных
+# неудобны), а список операций:
+#   ["set", путь, значение]  ["inc", путь, дельта]  ["push", путь, [значения], slice | None]
+
+def encode_update(update: dict) -> list:
+    ops = []
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set":
+                ops.append(["set", path, value])
+            elif operator == "$inc":
+                ops.append(["inc", path, value])
+            elif operator == "$push":
+                each = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                ops.append(["push", path, each, value.get("$slice") if isinstance(value, dict) else None])
+            else:
+                raise ValueError(f"оператор {operator} не поддерживается журналом")
+    return ops
+
+
+def _parent(doc: dict, path: str):
+    *parents, key = path.split(".")
+    for name in parents:
+        doc = doc.setdefault(name, {})
+    return doc, key
+
+
+def apply_ops(doc: dict, ops: list) -> dict:
+    """Применяет операции события к документу на месте — так же, как это
+    сделал бы MongoDB с исходным update.
+    """
+    for op in ops:
+        kind, path = op[0], op[1]
+        parent, key = _parent(doc, path)
+        if kind == "set":
+            parent[key] = op[2]
+        elif kind == "inc":
+            parent[key] = parent.get(key, 0) + op[2]
+        elif kind == "push":
+            values = parent.get(key) or []
+            values = values + list(op[2])
+            if op[3] is not None:
+                values = values[op[3]:] if op[3] < 0 else values[:op[3]]
+            parent[key] = values
+        else:
+            raise ValueError(f"неизвестная операция журнала {kind!r}")
+    return doc
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# РЕПОЗИТОРИЙ НА ЖУРНАЛЕ
+# ──────────────────────────────────────────────────────────────────────────────
+class JournalRepository(MongoPlayerRepository):
+    """Игрок = последний снапшот в players + хвост событий в player_events.
+
+    Каждое сохранение — маленький insert {uid, seq, ops, actions}. Версия
+    документа из PlayerRepository здесь — номер последнего события: seq
+    нового события равен version + 1, а уникальный индекс (uid, seq) делает
+    вставку compare-and-swap — чужое событие с тем же seq даёт
+    DuplicateKeyError, то есть конфликт версий.
+
+    Каждые SNAPSHOT_EVERY событий состояние сворачивается в снапшот (players:
+    game_data + v = seq). Вошедшие в снапшот события помечаются compacted_at и
+    удаляются TTL-индексом через JOURNAL_RETENTION_DAYS; до этого их можно
+    проиграть через history().
+    """
+
+    def __init__(self, uri: str, db_name: str = "forest_game", snapshot_every: int = SNAPSHOT_EVERY):
+        super().__init__(uri, db_name)
+        self.events = self.db["player_events"]
+        self.snapshot_every = snapshot_every
+        self._actions = {}  # uid -> callback'и, которые войдут в следующее событие
+        self._compactions = set()
+        self.snapshots = 0
+
+    async def ensure_indexes(self):
+        await super().ensure_indexes()
+        await self.events.create_index([("uid", ASCENDING), ("seq", ASCENDING)], unique=True)
+        await self.events.create_index("compacted_at", expireAfterSeconds=int(JOURNAL_RETENTION_DAYS * 86400))
+
+    def note_action(self, uid: int, action: str):
+        actions = self._actions.get(uid)
+        if actions is None:
+            if len(self._actions) >= JOURNAL_ACTIONS_PENDING:
+                self._actions.clear()  # только подписи к событиям — не страшно потерять
+            actions = self._actions[uid] = []
+        actions.append(action)
+
+    # ── чтение ───────────────────────────────────────────────────────────────
+    def _tail(self, uid: int, after: int):
+        return self.events.find({"uid": uid, "seq": {"$gt": after}}).sort("seq", ASCENDING)
+
+    async def load(self, uid: int) -> dict | None:
+        snapshot = await self.players.find_one({"_id": uid}, {"game_data": 1, "v": 1})
+        doc = {"_id": uid}
+        seq = 0
+        if snapshot is not None and "game_data" in snapshot:
+            doc["game_data"] = snapshot["game_data"]
+            seq = snapshot.get("v", 0)
+        async for event in self._tail(uid, seq):
+            apply_ops(doc, event["ops"])
+            seq = event["seq"]
+        if "game_data" not in doc:
+            return None
+        doc["v"] = seq
+        return doc
+
+    async def load_many(self, uids: list[int]) -> dict[int, dict]:
+        # Снапшота без хвоста событий мало — собираем каждого игрока через load()
+        return await PlayerRepository.load_many(self, uids)
+
+    async def history(self, uid: int, after: int = 0):
+        """Проигрывает сохранившиеся события игрока: (seq, время, действия, game_data после события).
+
+        Начинает с пустого состояния, поэтому полная история доступна, пока
+        первое (полное) событие ещё не удалено по сроку хранения.
+        """
+        doc = {}
+        async for event in self._tail(uid, after):
+            apply_ops(doc, event["ops"])
+            yield event["seq"], event.get("at"), event.get("actions", []), doc.get("game_data")
+
+    async def recent(self, limit: int) -> list[dict]:
+        """Последние сохранявшиеся игроки — снапшот плюс хвост событий, как в load()."""
+        cursor = self.players.find({"seen": {"$exists": True}}).sort("seen", DESCENDING).limit(limit)
+        docs = {doc["_id"]: doc async for doc in cursor}
+        if not docs:
+            return []
+        # Хвосты одним запросом: события выше версии снапшота ещё не свёрнуты
+        tails = self.events.find({"uid": {"$in": list(docs)}, "compacted_at": {"$exists": False}})
+        async for event in tails.sort([("uid", ASCENDING), ("seq", ASCENDING)]):
+            doc = docs[event["uid"]]
+            if event["seq"] > doc.get("v", 0):
+                apply_ops(doc, event["ops"])
+                doc["v"] = event["seq"]
+        return [doc for doc in docs.values() if "game_data" in doc]
+
+    async def versions(self, uids: list[int]) -> dict[int, int]:
+        result = {}
+        async for snapshot in self.players.find({"_id": {"$in": list(uids)}}, {"v": 1}):
+            result[snapshot["_id"]] = snapshot.get("v", 0)
+        cursor = await self.events.aggregate([
+            {"$match": {"uid": {"$in": list(uids)}}},
+            {"$group": {"_id": "$uid", "seq": {"$max": "$seq"}}},
+        ])
+        async for row in cursor:
+            result[row["_id"]] = max(result.get(row["_id"], 0), row["seq"])
+        return result
+
+    # ── запись ───────────────────────────────────────────────────────────────
+    def _event(self, uid: int, update: dict, version: int, now: datetime) -> dict:
+        return {
+            "uid": uid,
+            "seq": version + 1,
+            "at": now,
+            "ops": encode_update(update),
+            "actions": self._actions.pop(uid, []),
+        }
+
+    async def update(self, uid: int, update: dict, version: int) -> bool:
+        return not await self.update_many([(uid, update, version)])
+
+    async def update_many(self, items: list[tuple[int, dict, int]]) -> list[int]:
+        if not items:
+            return []
+        now = datetime.now(timezone.utc)
+        docs = [self._event(uid, update, version, now) for uid, update, version in items]
+        conflicts = []
+        try:
+            await self.events.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            conflicts = [items[err["index"]][0] for err in errors if err.get("code") == 11000]
+            if len(conflicts) < len(errors):
+                self._restore_actions([docs[err["index"]] for err in errors])
+                raise
+        except Exception:
+            # Неизвестно, что легло: лучше подписать действия повторно, чем потерять
+            self._restore_actions(docs)
+            raise
+        failed = set(conflicts)
+        written = [doc["uid"] for doc in docs if doc["uid"] not in failed]
+        if written:
+            # seen у снапшота — по нему recent() находит игроков для прогрева.
+            # События уже легли, так что сбой здесь не должен выглядеть как сбой записи
+            try:
+                await self.players.bulk_write(
+                    [UpdateOne({"_id": uid}, {"$currentDate": {"seen": True}}, upsert=True) for uid in written],
+                    ordered=False
+                )
+            except Exception as e:
+                logging.warning(f"Не удалось отметить seen для {len(written)} игроков: {e}")
+        self._restore_actions([doc for doc in docs if doc["uid"] in failed])
+        for doc in docs:
+            if doc["uid"] not in failed and doc["seq"] % self.snapshot_every == 0:
+                task = asyncio.create_task(self._compact(doc["uid"], doc["seq"]))
+                self._compactions.add(task)
+                task.add_done_callback(self._compactions.discard)
+        return conflicts
+
+    def _restore_actions(self, docs: list[dict]):
+        # Событие не легло — его действия подпишут следующую попытку
+        for doc in docs:
+            if doc["actions"]:
+                self._actions[doc["uid"]] = doc["actions"] + self._actions.get(doc["uid"], [])
+
+    async def _compact(self, uid: int, seq: int):
+        try:
+            doc = await self.load(uid)
+            if doc is None or doc["v"] < seq:
+                return
+            try:
+                # Не откатываем снапшот назад, если параллельно записали более свежий
+                await self.players.update_one(
+                    {"_id": uid, "v": {"$not": {"$gte": doc["v"]}}},
+                    {"$set": {"game_data": doc["game_data"], "v": doc["v"]}, "$currentDate": {"seen": True}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                return
+            await self.events.update_many(
+                {"uid": uid, "seq": {"$lte": doc["v"]}, "compacted_at": {"$exists": False}},
+                {"$set": {"compacted_at": datetime.now(timezone.utc)}}
+            )
+            self.snapshots += 1
+        except Exception as e:
+            logging.error(f"Не удалось свернуть журнал игрока {uid}: {e}")
+
+    async def close(self):
+        if self._compactions:
+            await asyncio.gather(*self._compactions, return_exceptions=True)
+        await super().close()
+
+
+def make_player_repository(uri: str) -> MongoPlayerRepository:
+    if PERSISTENCE_MODE == "journal":
+        return JournalRepository(uri)
+    if PERSISTENCE_MODE == "document":
+        return MongoPlayerRepository(uri)
+    raise ValueError(f"Неизвестный PERSISTENCE_MODE: {PERSISTENCE_MODE}")
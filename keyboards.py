@@ -1,15 +1,32 @@
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+# Клавиатуры кэшируются и отдаются одними и теми же объектами —
+# возвращённую клавиатуру нельзя менять (inline_keyboard.append и т.п.).
+KB_CACHE_SIZE = 512
+
 def get_main_kb(game):
-    kb = InlineKeyboardMarkup(inline_keyboard=[
+    return _main_kb(game.inventory['Бутылка воды'], game.water_capacity, game.weather == "rain")
+
+@lru_cache(maxsize=KB_CACHE_SIZE)
+def _main_kb(water: int, capacity: int, rain: bool):
+    rows = [
         [InlineKeyboardButton(text="Исследовать", callback_data="action_1"),
          InlineKeyboardButton(text="Инвентарь", callback_data="action_2")],
-        [InlineKeyboardButton(text=f"Пить ({game.inventory['Бутылка воды']}/{game.water_capacity})", callback_data="action_3") if game.inventory['Бутылка воды'] > 0 else InlineKeyboardButton(text="Пить (пусто)", callback_data="action_3"),
+        [InlineKeyboardButton(text=f"Пить ({water}/{capacity})", callback_data="action_3") if water > 0 else InlineKeyboardButton(text="Пить (пусто)", callback_data="action_3"),
          InlineKeyboardButton(text="Спать", callback_data="action_4")]
-    ])
-    if game.weather == "rain":
-        kb.inline_keyboard.append([InlineKeyboardButton(text="Собрать воду", callback_data="action_collect_water")])
-    return kb
+    ]
+    if rain:
+        rows.append([InlineKeyboardButton(text="Собрать воду", callback_data="action_collect_water")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@lru_cache(maxsize=KB_CACHE_SIZE)
+def menu_kb(items: tuple[tuple[str, str], ...]):
+    """Меню «по кнопке в строке» + Назад. items — ((текст, callback_data), ...)."""
+    rows = [[InlineKeyboardButton(text=text, callback_data=data)] for text, data in items]
+    rows.append([InlineKeyboardButton(text="Назад", callback_data="back")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 inventory_inline_kb = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Осмотреть", callback_data="inv_inspect"),
@@ -29,15 +46,6 @@ wolf_kb = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Использовать факел", callback_data="wolf_fight")]
 ])
 
-peek_kb = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text="Заглянуть внутрь", callback_data="peek_den")]
-])
-
-cat_kb = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text="Оставить его здесь", callback_data="cat_leave")],
-    [InlineKeyboardButton(text="Забрать с собой", callback_data="cat_take")]
-])
-
 next_kb = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Дальше", callback_data="story_next")]
 ])
@@ -0,0 +1,143 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import DESCENDING, UpdateOne
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+LEADERBOARD_MAX_SIZE = 100  # больше за один запрос не отдаём
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "30"))
+LEADERBOARD_NAME_LIMIT = 32
+LEADERBOARD_NAMES_PENDING = 10000  # имён, ждущих записи в сводку
+
+# Поле рейтинга -> порядок сортировки (второе поле разбивает ничьи)
+RANKINGS = {
+    "day": [("day", DESCENDING), ("karma", DESCENDING)],
+    "karma": [("karma", DESCENDING), ("day", DESCENDING)],
+}
+SUMMARY_FIELDS = ("day", "karma")
+
+
+def summary_changes(update: dict) -> dict:
+    """Поля сводки, которые меняет update-документ игрока (см. build_delta)."""
+    sets = update.get("$set", {})
+    game_data = sets.get("game_data")
+    if isinstance(game_data, dict):
+        return {f: game_data[f] for f in SUMMARY_FIELDS if f in game_data}
+    return {f: sets[f"game_data.{f}"] for f in SUMMARY_FIELDS if f"game_data.{f}" in sets}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# СВОДКА ДЛЯ РЕЙТИНГА
+# ──────────────────────────────────────────────────────────────────────────────
+class Leaderboard:
+    """Материализованная сводка игроков в коллекции leaderboard.
+
+    Обновляется из тех же дельт, что уходят в players, — без лишних чтений:
+    запись в сводку есть только когда у игрока изменились day или karma.
+    Рейтинги и статистика читаются только из сводки по индексам, коллекция
+    players при запросах не сканируется.
+    """
+
+    def __init__(self, db, cache_ttl: float = LEADERBOARD_CACHE_TTL):
+        self.players = db["players"]
+        self.summary = db["leaderboard"]
+        self.cache_ttl = cache_ttl
+        self._names = {}  # uid -> имя, допишется в сводку со следующей записью
+        self._cache = {}  # ключ запроса -> (истекает, результат)
+
+    async def ensure_indexes(self):
+        for order in RANKINGS.values():
+            await self.summary.create_index(order)
+        await self.summary.create_index([("updated_at", DESCENDING)])
+        if await self.summary.estimated_document_count() == 0:
+            await self.rebuild()
+
+    async def rebuild(self):
+        """Заполняет сводку из players целиком на стороне сервера (один раз при пустой сводке)."""
+        started = time.perf_counter()
+        await self.players.aggregate([
+            {"$match": {"game_data": {"$exists": True}}},
+            {"$project": {"day": "$game_data.day", "karma": "$game_data.karma"}},
+            {"$merge": {"into": self.summary.name, "whenMatched": "merge", "whenNotMatched": "insert"}},
+        ])
+        logging.info(f"Сводка рейтинга перестроена за {time.perf_counter() - started:.2f} сек")
+
+    def remember_name(self, uid: int, name: str | None):
+        if not name:
+            return
+        if len(self._names) >= LEADERBOARD_NAMES_PENDING:
+            self._names.clear()  # имена без последующих сохранений — не страшно потерять
+        self._names[uid] = name[:LEADERBOARD_NAME_LIMIT]
+
+    async def record(self, items: list[tuple[int, dict]]):
+        """Вызывается после успешной записи игроков; ошибки только логируются —
+        сводка производная и догонит при следующем сохранении.
+        """
+        now = datetime.now(timezone.utc)
+        ops = []
+        for uid, update in items:
+            changes = summary_changes(update)
+            if changes:
+                changes["updated_at"] = now
+            name = self._names.pop(uid, None)
+            if name is not None:
+                changes["name"] = name
+            if changes:
+                ops.append(UpdateOne({"_id": uid}, {"$set": changes}, upsert=True))
+        if not ops:
+            return
+        try:
+            await self.summary.bulk_write(ops, ordered=False)
+        except Exception as e:
+            logging.error(f"Не удалось обновить сводку рейтинга ({len(ops)} игроков): {e}")
+
+    async def _cached(self, key, load):
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        value = await load()
+        self._cache[key] = (now + self.cache_ttl, value)
+        return value
+
+    async def top(self, by: str = "day", limit: int = LEADERBOARD_SIZE) -> list[dict]:
+        if by not in RANKINGS:
+            raise ValueError(f"Неизвестный рейтинг: {by}")
+        limit = max(1, min(limit, LEADERBOARD_MAX_SIZE))
+
+        async def load():
+            cursor = self.summary.find({}, {"name": 1, "day": 1, "karma": 1}).sort(RANKINGS[by]).limit(limit)
+            return [doc async for doc in cursor]
+        return await self._cached(("top", by, limit), load)
+
+    async def stats(self) -> dict:
+        async def load():
+            best_day = await self.top("day", 1)
+            best_karma = await self.top("karma", 1)
+            since = datetime.now(timezone.utc) - timedelta(days=1)
+            return {
+                "players": await self.summary.estimated_document_count(),
+                # updated_at меняется, только когда растут day/karma — «продвинулись за сутки»
+                "progressed_24h": await self.summary.count_documents({"updated_at": {"$gte": since}}),
+                "best_day": best_day[0].get("day", 0) if best_day else 0,
+                "best_karma": best_karma[0].get("karma", 0) if best_karma else 0,
+            }
+        return await self._cached(("stats",), load)
+
+
+def player_name(doc: dict) -> str:
+    return doc.get("name") or f"Игрок #{str(doc['_id'])[-4:]}"
+
+
+def format_top(rows: list[dict], by: str = "day") -> str:
+    if not rows:
+        return "Пока никто не выжил достаточно долго, чтобы попасть в рейтинг."
+    title = "Дольше всех выживают:" if by == "day" else "Лучшая карма:"
+    lines = [f"{i}. {player_name(doc)} — день {doc.get('day', 0)}, карма {doc.get('karma', 0)}"
+             for i, doc in enumerate(rows, 1)]
+    return title + "\n\n" + "\n".join(lines)
@@ -1,21 +1,30 @@
 import asyncio
+import hashlib
 import logging
 import os
 import time
-import random
-from collections import Counter
+from itertools import chain, count
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.types import Update, Message
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandStart
 from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 import httpx
-from pymongo import MongoClient
 
-from keyboards import get_main_kb, inventory_inline_kb, character_inline_kb, wolf_kb, peek_kb, cat_kb, next_kb
-from crafts import handle_craft
-from stories import handle_story
+from storage import WriteBehindSaver, build_delta, rebase_state
+from journal import PERSISTENCE_MODE, make_player_repository
+from sessions import SessionCache, UserLocks
+from sender import OutboundDispatcher
+from workers import UpdateWorkerPool
+from state import WORKER_ID, make_state_backend
+from throttle import ActionThrottle
+from world import WORLD_TICK_INTERVAL, WorldClock
+from leaderboard import Leaderboard, format_top
+from metrics import REGISTRY, CALLBACK_SECONDS, MONGO_SECONDS, METRICS_TOKEN, CONTENT_TYPE
+
+from game import Game, LOG_LIMIT
+from actions import DAY_AP, STAT_MAX, router, screens
 
 # ──────────────────────────────────────────────────────────────────────────────
 # НАСТРОЙКИ
@@ -37,146 +46,151 @@ logging.info(f"Бот запущен. TOKEN: {TOKEN[:10]}... BASE_URL: {BASE_URL
 
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
+outbox = OutboundDispatcher(bot)
 app = FastAPI(title="Forest Survival Bot")
 
-last_request_time = {}
-last_active_msg_id = {}
-research_count_day2 = {}
+SENT_MESSAGES_LIMIT = 100  # сколько id сообщений чата помнить для очистки при /start
+background_tasks = set()
 
 # ──────────────────────────────────────────────────────────────────────────────
 # MONGODB
 # ──────────────────────────────────────────────────────────────────────────────
-mongo_client = MongoClient(MONGO_URI)
-db = mongo_client['forest_game']
-players_collection = db['players']
-mongo_client.server_info()
-logging.info("MongoDB подключён успешно")
-
-# ──────────────────────────────────────────────────────────────────────────────
-# КЛАСС ИГРЫ
-# ──────────────────────────────────────────────────────────────────────────────
-class Game:
-    def __init__(self):
-        self.hp = 100
-        self.hunger = 20
-        self.thirst = 60
-        self.ap = 5
-        self.karma = 0
-        self.karma_goal = 100
-        self.day = 1
-        self.log = ["Ты проснулся в лесу. Что будешь делать?"]
-        self.inventory = Counter({
-            "Спички ": 1,
-            "Вилка ": 1,
-            "Кусок коры ": 1,
-            "Сухпай": 3,
-            "Бутылка воды": 10
-        })
-        self.weather = "clear"
-        self.location = "лес"
-        self.unlocked_locations = ["лес", "тёмный лес", "озеро", "заброшенный лагерь"]
-        self.water_capacity = 10
-        self.equipment = {
-            "head": None,
-            "torso": None,
-            "back": None,
-            "pants": None,
-            "boots": None,
-            "trinket": None,
-            "pet": None,
-            "hand": None
-        }
-        self.story_state = None
-        self.found_branch_once = False
-        self.nav_stack = ["main"]  # стек навигации
-
-    def add_log(self, text):
-        self.log.append(text)
-        if len(self.log) > 20:
-            self.log = self.log[-20:]
-
-    def push_screen(self, screen: str):
-        self.nav_stack.append(screen)
-
-    def pop_screen(self):
-        if len(self.nav_stack) > 1:
-            self.nav_stack.pop()
-        return self.nav_stack[-1]
-
-    def reset_nav(self):
-        self.nav_stack = ["main"]
-
-    def get_ui(self):
-        weather_icon = {"clear": " ", "cloudy": " ", "rain": " "}.get(self.weather, " ")
-        return (
-            f" {self.hp}    {self.hunger}    {self.thirst}    {self.ap}    {weather_icon} {self.day}\n"
-            "━━━━━━━━━━━━━━━━━━━\n"
-            + "\n".join(f"> {line}" for line in self.log) + "\n"
-            "━━━━━━━━━━━━━━━━━━━"
-        )
-
-    def get_inventory_text(self):
-        lines = []
-        equipped_hand = self.equipment.get("hand")
-        for item, count in self.inventory.items():
-            if count > 0:
-                marker = " " if item == "Факел" else ""
-                equipped_mark = " " if item == equipped_hand else ""
-                line = f"• {item} x{count}{marker}{equipped_mark}" if count > 1 else f"• {item}{marker}{equipped_mark}"
-                lines.append(line)
-        text = "Инвентарь:\n" + "\n".join(lines) if lines else "Инвентарь пуст"
-        text += "\n━━━━━━━━━━━━━━━━━━━"
-        return text
-
-    def get_character_text(self):
-        pet_text = f"Питомец: {self.equipment['pet']}" if self.equipment.get("pet") else "Питомец: Пусто"
-        slots = {
-            "head": "Голова",
-            "torso": "Торс",
-            "back": "Спина",
-            "pants": "Штаны",
-            "boots": "Ботинки",
-            "trinket": "Безделушка",
-            "pet": pet_text,
-            "hand": "Рука"
-        }
-        lines = [f"{name}: {self.equipment.get(slot) or 'Пусто'}" for slot, name in slots.items()]
-        return "Персонаж:\n\n" + "\n".join(lines)
+# Клиент асинхронный: соединения открываются лениво, цикл событий не блокируется
+# PERSISTENCE_MODE=journal — события + снапшоты вместо одного документа на игрока
+repo = make_player_repository(MONGO_URI)
+# Антиспам, активные сообщения и очистка чата — общие для всех воркеров
+shared = make_state_backend(repo.db)
+throttle = ActionThrottle(shared)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # СОХРАНЕНИЕ / ЗАГРУЗКА
 # ──────────────────────────────────────────────────────────────────────────────
-def load_game(uid: int) -> Game | None:
+def game_from_document(data: dict) -> Game:
+    game_data = data["game_data"]
+    game = Game.decode(game_data)
+    # В базе ровно то, что прочитали: миграции и недостающие поля допишутся при сохранении
+    game._saved = {k: v.copy() if isinstance(v, (dict, list)) else v for k, v in game_data.items()}
+    game._version = data.get("v", 0)
+    return game
+
+class GameLoadError(Exception):
+    """Сохранение не удалось прочитать: поверх него нельзя ни начинать, ни писать игру."""
+
+async def load_game(uid: int) -> Game | None:
+    """Игра игрока или None, если сохранения нет. Сбой чтения — GameLoadError."""
+    pending = saver.pending(uid)
+    if pending is not None:
+        return pending
+    started = time.perf_counter()
     try:
-        data = players_collection.find_one({"_id": uid})
-        if data and "game_data" in data:
-            game = Game()
-            inv_dict = data["game_data"].pop("inventory", {})
-            equip_dict = data["game_data"].pop("equipment", {})
-            game.__dict__.update(data["game_data"])
-            game.inventory = Counter(inv_dict)
-            game.equipment = equip_dict
-            if "nav_stack" not in game.__dict__:
-                game.nav_stack = ["main"]
-            return game
+        data = await repo.load(uid)
     except Exception as e:
+        MONGO_SECONDS.observe(time.perf_counter() - started, "load_error")
         logging.error(f"Ошибка загрузки {uid}: {e}")
-    return None
-
-def save_game(uid: int, game: Game):
+        raise GameLoadError(str(e)) from e
+    MONGO_SECONDS.observe(time.perf_counter() - started, "load")
+    if not data or "game_data" not in data:
+        return None
     try:
-        data = game.__dict__.copy()
-        data["inventory"] = dict(game.inventory)
-        data["equipment"] = game.equipment
-        players_collection.update_one(
-            {"_id": uid},
-            {"$set": {"game_data": data}},
-            upsert=True
-        )
+        return game_from_document(data)
     except Exception as e:
-        logging.error(f"Ошибка сохранения {uid}: {e}")
+        # Например, схема новее этой версии бота — документ не трогаем
+        logging.error(f"Не удалось прочитать сохранение {uid}: {e}")
+        raise GameLoadError(str(e)) from e
+
+# Границы полей, которые после переноса чужих изменений могут выйти за допустимое
+STAT_BOUNDS = {"hp": (0, STAT_MAX), "hunger": (0, STAT_MAX), "thirst": (0, STAT_MAX), "ap": (0, DAY_AP)}
+
+def clamp_stats(state: dict) -> dict:
+    for name, (low, high) in STAT_BOUNDS.items():
+        if isinstance(state.get(name), int):
+            state[name] = min(high, max(low, state[name]))
+    return state
+
+class PendingSave:
+    """Одна попытка записи игры.
+
+    state — что пишем, base — сохранённое состояние, от которого считали
+    изменения, taken — снимок игры в момент подсчёта, version — версия
+    документа, поверх которой пишем, log_new — новые строки лога в taken.
+    """
+    __slots__ = ("state", "log_new", "base", "taken", "version")
+
+    def __init__(self, state: dict, log_new: int, base: dict | None, taken: dict, version: int):
+        self.state = state
+        self.log_new = log_new
+        self.base = base
+        self.taken = taken
+        self.version = version
+
+class GameChanges:
+    """Связка Game с WriteBehindSaver: считает дельту, переносит её на чужие
+    изменения при конфликте версий и фиксирует сохранённое.
+    """
+
+    @staticmethod
+    def diff(game: Game):
+        state = game.snapshot()
+        save = PendingSave(state, game._log_new, game._saved, state, game._version)
+        return build_delta(game._saved, state, game._log_new, LOG_LIMIT), save
+
+    @staticmethod
+    def version(game: Game) -> int:
+        return game._version
+
+    @staticmethod
+    def rebase(game: Game, save: PendingSave, doc: dict | None):
+        current = doc.get("game_data") if doc else None
+        version = doc.get("v", 0) if doc else 0
+        base, log_new = save.base, save.log_new
+        if game._unconfirmed is not None and current is not None:
+            state, lines, attempted = game._unconfirmed
+            if version == attempted + 1 and build_delta(current, state, 0, LOG_LIMIT) is None:
+                base, log_new = state, log_new - lines  # прошлая запись всё-таки легла
+        if current is None or base is None:
+            # Документа нет или игрок явно начал новую игру — пишем целиком
+            merged = save.taken
+            update = {"$set": {"game_data": merged}}
+        else:
+            merged = clamp_stats(rebase_state(base, save.taken, current, log_new, LOG_LIMIT))
+            update = build_delta(current, merged, log_new, LOG_LIMIT)
+        return update, PendingSave(merged, save.log_new, save.base, save.taken, version)
+
+    @staticmethod
+    def commit(game: Game, save: PendingSave, version: int):
+        if save.state is not save.taken:
+            # В базу легли и чужие изменения — переносим их на игру в памяти,
+            # не теряя того, что игрок успел сделать после снимка
+            unsaved = game._log_new - save.log_new
+            game.adopt(clamp_stats(rebase_state(save.taken, game.snapshot(), save.state, unsaved, LOG_LIMIT)))
+        game._saved = save.state
+        game._version = version
+        game._unconfirmed = None
+        game._log_new -= save.log_new
+
+    @staticmethod
+    def reset(game: Game, save: PendingSave):
+        game._unconfirmed = (save.state, save.log_new, save.version)
 
-games = {}
+def save_game(uid: int, game: Game):
+    saver.mark_dirty(uid, game)
+
+# Рейтинг: сводка обновляется из тех же дельт, что ушли в базу
+leaderboard = Leaderboard(repo.db)
+saver = WriteBehindSaver(repo, GameChanges, after_write=leaderboard.record)
+
+# Активные игры: при вытеснении игра уходит в отложенную запись,
+# при промахе — тихо поднимается из базы
+games = SessionCache(load_game, on_evict=save_game)
+# Апдейты одного игрока обрабатываются строго по одному
+user_locks = UserLocks()
+# Погода и голод идут для всех сразу — одним запросом к базе
+# В режиме журнала тик правил бы снапшоты в обход событий — там мир пока стоит
+world = WorldClock(repo.db, lambda: chain(games.values(), saver.pending_games()), saver.paused,
+                   interval=WORLD_TICK_INTERVAL if PERSISTENCE_MODE == "document" else 0)
+if PERSISTENCE_MODE != "document" and WORLD_TICK_INTERVAL > 0:
+    logging.warning(f"PERSISTENCE_MODE={PERSISTENCE_MODE}: тик мира отключён — погода не меняется, "
+                    "сытость и вода со временем не убывают")
 
 # ──────────────────────────────────────────────────────────────────────────────
 # ПРИВЕТСТВИЕ
@@ -192,53 +206,109 @@ GUIDE_TEXT = (
     "Карма поможет выбраться.\n\n"
     "Попробуй выжить друг мой..."
 )
+LOAD_ERROR_TEXT = "Не удалось загрузить сохранение. Попробуй чуть позже — игра никуда не делась."
 
 # ──────────────────────────────────────────────────────────────────────────────
-# ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ С RETRY ПРИ FLOOD
+# ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ (ЛИМИТЫ И RETRY — В OUTBOX)
 # ──────────────────────────────────────────────────────────────────────────────
+def screen_fingerprint(text: str, reply_markup=None) -> int:
+    # Отпечаток должен совпадать между процессами, поэтому не hash(): он солится в каждом
+    h = hashlib.blake2b(text.encode(), digest_size=8)
+    if reply_markup is not None:
+        for row in reply_markup.inline_keyboard:
+            for button in row:
+                h.update(b"\x00" + button.text.encode() + b"\x01" + (button.callback_data or "").encode())
+            h.update(b"\x02")
+    return int.from_bytes(h.digest(), "big", signed=True)
+
 async def update_or_send_message(chat_id: int, uid: int, text: str, reply_markup=None):
-    msg_id = last_active_msg_id.get(uid)
-    if msg_id:
+    screen = await shared.get_screen(uid)
+    fingerprint = screen_fingerprint(text, reply_markup)
+    if screen:
+        msg_id = screen["msg"]
+        if screen.get("fp") == fingerprint:
+            return msg_id  # на экране уже ровно это — edit не нужен
         try:
-            await bot.edit_message_text(
+            await outbox.edit_message_text(
                 text, chat_id=chat_id, message_id=msg_id, reply_markup=reply_markup
             )
+            await shared.set_screen(uid, msg_id, fingerprint)
             return msg_id
         except TelegramRetryAfter as e:
-            logging.warning(f"Flood control: ждём {e.retry_after} сек перед повтором edit")
-            await asyncio.sleep(e.retry_after + 0.5)
-            try:
-                await bot.edit_message_text(
-                    text, chat_id=chat_id, message_id=msg_id, reply_markup=reply_markup
-                )
-                return msg_id
-            except Exception as ex:
-                logging.error(f"Повторная ошибка при edit после retry: {ex}")
+            logging.error(f"Edit {msg_id} для {uid} не прошёл после повторов: {e}")
+            return msg_id
         except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                await shared.set_screen(uid, msg_id, fingerprint)
+                return msg_id
             logging.warning(f"Не удалось отредактировать {msg_id} для {uid}: {e}")
             try:
-                await bot.delete_message(chat_id, msg_id)
+                await outbox.delete_message(chat_id, msg_id)
             except:
                 pass
-            last_active_msg_id.pop(uid, None)
-    msg = await bot.send_message(chat_id, text, reply_markup=reply_markup)
-    last_active_msg_id[uid] = msg.message_id
+    msg = await outbox.send_message(chat_id, text, reply_markup=reply_markup)
+    await shared.set_screen(uid, msg.message_id, fingerprint)
+    await shared.track_message(chat_id, msg.message_id, SENT_MESSAGES_LIMIT)
     return msg.message_id
 
+# ──────────────────────────────────────────────────────────────────────────────
+# ОЧИСТКА ЧАТА
+# ──────────────────────────────────────────────────────────────────────────────
+async def delete_tracked_messages(chat_id: int, message_ids: list[int]):
+    try:
+        await outbox.delete_messages(chat_id, message_ids)
+    except Exception as e:
+        logging.warning(f"Не удалось очистить чат {chat_id}: {e}")
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# ──────────────────────────────────────────────────────────────────────────────
+# СЕССИИ НА НЕСКОЛЬКИХ ВОРКЕРАХ
+# ──────────────────────────────────────────────────────────────────────────────
+async def claim_session(uid: int):
+    # Если прошлый апдейт игрока обработал другой воркер, локальная копия игры
+    # могла устареть — выбрасываем её, следующее обращение поднимет игру из базы
+    previous = await shared.claim_session(uid, WORKER_ID)
+    if previous is not None and previous != WORKER_ID:
+        game = games.get(uid)
+        if game is None:
+            return
+        # Копия не устарела, если версия документа не менялась (например, прогретая при старте)
+        try:
+            current = (await repo.versions([uid])).get(uid, 0)
+        except Exception:
+            current = None
+        if current != game._version:
+            games.pop(uid)
+
 # ──────────────────────────────────────────────────────────────────────────────
 # ХЕНДЛЕРЫ
 # ──────────────────────────────────────────────────────────────────────────────
 @dp.message(CommandStart())
 async def cmd_start(message: Message):
+    async with user_locks.hold(message.from_user.id):
+        await start_game(message)
+
+async def start_game(message: Message):
     uid = message.from_user.id
     chat_id = message.chat.id
     logging.info(f"[START] Получен /start от {uid}")
+    leaderboard.remember_name(uid, message.from_user.first_name)
+    # Удаляем только то, что реально отправляли, одним-двумя deleteMessages в фоне
+    old_ids = await shared.pop_tracked(chat_id)
+    if old_ids:
+        await shared.clear_screen(uid)
+        run_in_background(delete_tracked_messages(chat_id, old_ids))
+    await shared.track_message(chat_id, message.message_id, SENT_MESSAGES_LIMIT)
+    await claim_session(uid)
     try:
-        for i in range(1, 50):
-            await bot.delete_message(chat_id, message.message_id - i)
-    except:
-        pass
-    loaded = load_game(uid)
+        loaded = await games.get_or_load(uid)
+    except GameLoadError:
+        await update_or_send_message(chat_id, uid, LOAD_ERROR_TEXT)
+        return
     if loaded:
         text = "Есть сохранение. Что делаем?"
         kb = types.InlineKeyboardMarkup(inline_keyboard=[
@@ -252,173 +322,226 @@ async def cmd_start(message: Message):
         ])
     await update_or_send_message(chat_id, uid, text, kb)
 
+SESSION_CALLBACKS = ("new_game", "start_new_game", "load_game")
+
+@dp.message(Command("top"))
+async def cmd_top(message: Message):
+    chat_id = message.chat.id
+    await shared.track_message(chat_id, message.message_id, SENT_MESSAGES_LIMIT)
+    try:
+        text = format_top(await leaderboard.top("day"))
+    except Exception as e:
+        logging.error(f"Не удалось получить рейтинг: {e}")
+        text = "Рейтинг сейчас недоступен, попробуй позже."
+    msg = await outbox.send_message(chat_id, text)
+    await shared.track_message(chat_id, msg.message_id, SENT_MESSAGES_LIMIT)
+
 @dp.callback_query()
 async def process_callback(callback: types.CallbackQuery):
     uid = callback.from_user.id
-    chat_id = callback.message.chat.id
-    now = time.time()
-    if uid in last_request_time and now - last_request_time[uid] < 1.0:
+    data = callback.data
+    if not await throttle.allow(uid, data):
         await callback.answer("Подожди немного...")
         return
-    last_request_time[uid] = now + 0.2
-    data = callback.data
     logging.info(f"[CALLBACK] {data} от {uid}")
-    game = games.get(uid)
+    if data in SESSION_CALLBACKS:
+        action, handler = data, None
+    else:
+        action, handler = router.route(data)
+    started = time.perf_counter()
+    try:
+        async with user_locks.hold(uid):
+            await handle_callback(callback, uid, data, handler)
+    finally:
+        CALLBACK_SECONDS.observe(time.perf_counter() - started, action or "unknown")
+
+async def handle_callback(callback: types.CallbackQuery, uid: int, data: str, handler):
+    chat_id = callback.message.chat.id
+    await claim_session(uid)
     if data in ("new_game", "start_new_game"):
+        previous = games.get(uid)
         game = Game()
-        games[uid] = game
+        if previous is not None:
+            game._version = previous._version  # новая игра перезаписывает тот же документ
+        games.put(uid, game)
+        repo.note_action(uid, data)
         save_game(uid, game)
-        await update_or_send_message(chat_id, uid, game.get_ui(), get_main_kb(game))
+        await update_or_send_message(chat_id, uid, *screens.render("main", game))
         await callback.answer()
         return
+    try:
+        game = await games.get_or_load(uid)
+    except GameLoadError:
+        await callback.answer(LOAD_ERROR_TEXT, show_alert=True)
+        return
     if data == "load_game":
-        game = load_game(uid) or Game()
-        games[uid] = game
+        game = game or Game()
+        games.put(uid, game)
+        repo.note_action(uid, data)
         save_game(uid, game)
-        await update_or_send_message(chat_id, uid, game.get_ui(), get_main_kb(game))
+        await update_or_send_message(chat_id, uid, *screens.render("main", game))
         await callback.answer()
         return
     if not game:
         await callback.answer("Сначала начни игру /start")
         return
-    text = None
-    kb = None
-    action_taken = False
-
-    if data == "action_2":
-        game.push_screen("inventory")
-        text = game.get_inventory_text()
-        kb = inventory_inline_kb
-    elif data == "inv_character":
-        game.push_screen("character")
-        text = game.get_character_text()
-        kb = character_inline_kb
-    elif data == "inv_craft":
-        game.push_screen("craft")
-        kb_c = types.InlineKeyboardMarkup(inline_keyboard=[])
-        if game.inventory.get("Спички ", 0) >= 1 and game.inventory.get("Ветка", 0) >= 1:
-            kb_c.inline_keyboard.append([
-                types.InlineKeyboardButton(text="Факел (1 ветка + 1 спичка)", callback_data="craft_Факел")
-            ])
-            craft_text = "Доступный крафт:"
-        else:
-            craft_text = "Пока ничего нельзя скрафтить.\n(нужна Ветка и Спички )"
-        kb_c.inline_keyboard.append([types.InlineKeyboardButton(text="Назад", callback_data="back")])
-        text = craft_text
-        kb = kb_c
-    elif data == "inv_use":
-        game.push_screen("use")
-        kb_u = types.InlineKeyboardMarkup(inline_keyboard=[])
-        if game.inventory.get("Факел", 0) > 0 and game.equipment["hand"] is None:
-            kb_u.inline_keyboard.append([types.InlineKeyboardButton(text="Факел ", callback_data="use_item_Факел")])
-        if not kb_u.inline_keyboard:
-            kb_u.inline_keyboard.append([types.InlineKeyboardButton(text="Нечего использовать", callback_data="dummy")])
-        kb_u.inline_keyboard.append([types.InlineKeyboardButton(text="Назад", callback_data="back")])
-        text = "Что использовать?"
-        kb = kb_u
-
-    elif data == "back":
-        prev = game.pop_screen()
-        if prev == "main":
-            text = game.get_ui()
-            kb = get_main_kb(game)
-        elif prev == "inventory":
-            text = game.get_inventory_text()
-            kb = inventory_inline_kb
-        elif prev == "character":
-            text = game.get_character_text()
-            kb = character_inline_kb
-        elif prev == "craft":
-            kb_c = types.InlineKeyboardMarkup(inline_keyboard=[])
-            if game.inventory.get("Спички ", 0) >= 1 and game.inventory.get("Ветка", 0) >= 1:
-                kb_c.inline_keyboard.append([
-                    types.InlineKeyboardButton(text="Факел (1 ветка + 1 спичка)", callback_data="craft_Факел")
-                ])
-                craft_text = "Доступный крафт:"
-            else:
-                craft_text = "Пока ничего нельзя скрафтить.\n(нужна Ветка и Спички )"
-            kb_c.inline_keyboard.append([types.InlineKeyboardButton(text="Назад", callback_data="back")])
-            text = craft_text
-            kb = kb_c
-        elif prev == "use":
-            text = game.get_ui()
-            kb = get_main_kb(game)
-        else:
-            text = game.get_ui()
-            kb = get_main_kb(game)
-
-    elif data.startswith("craft_") or data.startswith("use_item_"):
-        text, kb = handle_craft(data, game, uid)
-        if text is None:
-            text = game.get_inventory_text()
-            kb = inventory_inline_kb
-
-    elif data in ("wolf_flee", "wolf_fight", "peek_den", "cat_leave", "cat_take", "story_next"):
-        text, kb = handle_story(data, game, uid)
-
-    elif data == "action_1":
-        if game.ap <= 0:
-            game.add_log("Действия на сегодня закончились.")
-            text = game.get_ui()
-            kb = get_main_kb(game)
-        else:
-            game.ap -= 1
-            possible = ["Ветка", "Камень", "Ягода", "Гриб"]
-            found = random.choice(possible)
-            game.inventory[found] += 1
-            game.add_log(f"Нашёл: {found}")
-            text = game.get_ui()
-            kb = get_main_kb(game)
-            action_taken = True
-
-    elif data == "action_3":
-        if game.ap <= 0:
-            game.add_log("Действия на сегодня закончились.")
-        elif game.inventory["Бутылка воды"] > 0:
-            game.inventory["Бутылка воды"] -= 1
-            game.thirst = min(100, game.thirst + 30)
-            game.add_log("Ты сделал глоток воды. Жажда уменьшилась.")
-            action_taken = True
-        else:
-            game.add_log("Воды больше нет.")
-        text = game.get_ui()
-        kb = get_main_kb(game)
-
-    elif data == "action_4":
-        if game.ap <= 0:
-            game.add_log("Действия на сегодня закончились.")
-        else:
-            game.hp = min(100, game.hp + 40)
-            game.hunger = max(0, game.hunger - 20)
-            game.thirst = max(0, game.thirst - 15)
-            game.day += 1
-            game.ap = 5
-            game.add_log("Ты уснул. Новый день начался.")
-            action_taken = True
-        text = game.get_ui()
-        kb = get_main_kb(game)
-
-    elif data == "action_collect_water":
-        if game.weather == "rain" and game.inventory["Бутылка воды"] < game.water_capacity:
-            add = min(5, game.water_capacity - game.inventory["Бутылка воды"])
-            game.inventory["Бутылка воды"] += add
-            game.add_log(f"Собрал {add} воды в бутылку.")
-        text = game.get_ui()
-        kb = get_main_kb(game)
+    text, kb = handler(data, game, uid) if handler else (None, None)
 
     if text is not None:
         await update_or_send_message(chat_id, uid, text, kb)
+        repo.note_action(uid, data)
         save_game(uid, game)
     await callback.answer()
 
 # ──────────────────────────────────────────────────────────────────────────────
 # WEBHOOK
 # ──────────────────────────────────────────────────────────────────────────────
+async def handle_update(update: Update):
+    await dp.feed_update(bot, update)
+
+updates = UpdateWorkerPool(handle_update)
+
+# ──────────────────────────────────────────────────────────────────────────────
+# МЕТРИКИ
+# ──────────────────────────────────────────────────────────────────────────────
+# Очереди и счётчики читаются из объектов в момент запроса /metrics
+REGISTRY.reading("bot_update_queue_depth", "Апдейты, ждущие обработки или в обработке", updates.depth)
+REGISTRY.reading("bot_updates_total", "Апдейты по исходу обработки",
+                 lambda: {"processed": updates.processed, "rejected": updates.rejected, "failed": updates.failed},
+                 type="counter", label="result")
+REGISTRY.reading("bot_outbox_queue_depth", "Запросы в исходящей очереди Bot API", outbox.queue_depth)
+REGISTRY.reading("bot_outbox_sent_total", "Выполненные запросы к Bot API", lambda: outbox.sent, type="counter")
+REGISTRY.reading("bot_outbox_coalesced_total", "Правки, схлопнутые с более свежей", lambda: outbox.coalesced,
+                 type="counter")
+REGISTRY.reading("bot_telegram_retry_after_total", "Ответы flood control (RetryAfter)", lambda: outbox.retry_after,
+                 type="counter")
+REGISTRY.reading("bot_save_queue_depth", "Игры, ждущие отложенной записи", lambda: len(saver))
+REGISTRY.reading("bot_saves_total", "Записанные в базу игры", lambda: saver.writes, type="counter")
+REGISTRY.reading("bot_save_conflicts_total", "Записи, упёршиеся в чужую версию документа",
+                 lambda: saver.conflicts, type="counter")
+REGISTRY.reading("bot_session_cache_size", "Игры в кэше сессий", lambda: len(games))
+REGISTRY.reading("bot_session_cache_total", "Обращения к кэшу сессий",
+                 lambda: {"hit": games.hits, "miss": games.misses, "eviction": games.evictions},
+                 type="counter", label="event")
+REGISTRY.reading("bot_world_ticks_total", "Тики мира, выполненные этим воркером", lambda: world.ticks,
+                 type="counter")
+REGISTRY.reading("bot_throttle_total", "Решения антиспама",
+                 lambda: {"allowed": throttle.allowed, "throttled": throttle.throttled},
+                 type="counter", label="result")
+REGISTRY.reading("bot_throttled_actions_total", "Отклонённые антиспамом callback'и, по действиям",
+                 lambda: throttle.throttled_by_action, type="counter", label="action")
+if PERSISTENCE_MODE == "journal":
+    REGISTRY.reading("bot_journal_snapshots_total", "Снапшоты, свёрнутые из журнала этим воркером",
+                     lambda: repo.snapshots, type="counter")
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=403)
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/leaderboard")
+async def leaderboard_endpoint(by: str = "day", limit: int = 10):
+    try:
+        top = await leaderboard.top(by, limit)
+    except ValueError:
+        raise HTTPException(status_code=400)
+    rows = [{"rank": i, "day": doc.get("day", 0), "karma": doc.get("karma", 0)} for i, doc in enumerate(top, 1)]
+    return {"by": by, "top": rows, "stats": await leaderboard.stats()}
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ЗАПУСК И ГОТОВНОСТЬ
+# ──────────────────────────────────────────────────────────────────────────────
+# Процесс принимает HTTP сразу; MongoDB и прогрев подключаются в фоне,
+# а /readyz и вебхук ждут, пока база ответит. До MongoDB достукиваемся, пока
+# не ответит: иначе живой по /healthz процесс навсегда остался бы неготовым.
+STARTUP_RETRIES = int(os.getenv("STARTUP_RETRIES", "6"))
+STARTUP_RETRY_DELAY = float(os.getenv("STARTUP_RETRY_DELAY", "0.5"))  # удваивается, но не больше 10 сек
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+WARMUP_SESSIONS = int(os.getenv("WARMUP_SESSIONS", "500"))
+
+checks = {"mongo": False, "indexes": False, "sessions": False, "webhook": WEBHOOK_URL is None}
+
+async def with_retry(name: str, fn, attempts: int | None = STARTUP_RETRIES):
+    """attempts=None — повторять, пока не получится."""
+    delay = STARTUP_RETRY_DELAY
+    for attempt in count(1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            logging.warning(f"{name}: попытка {attempt} не удалась ({e}), повтор через {delay:.1f} сек")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+async def preload_sessions():
+    docs = await repo.recent(WARMUP_SESSIONS)
+    for data in docs:
+        if data["_id"] not in games and "game_data" in data:
+            try:
+                games.put(data["_id"], game_from_document(data))
+            except Exception as e:
+                logging.warning(f"Прогрев: пропускаю игру {data['_id']}: {e}")
+    return len(docs)
+
+async def warm_up():
+    started = time.perf_counter()
+    try:
+        await with_retry("MongoDB", repo.ping)
+    except Exception as e:
+        logging.error(f"MongoDB недоступен после {STARTUP_RETRIES} попыток: {e}; продолжаю ждать в фоне")
+        await with_retry("MongoDB", repo.ping, attempts=None)
+    checks["mongo"] = True
+    logging.info("MongoDB подключён успешно")
+    # Несколько параллельных ping открывают соединения пула заранее
+    await asyncio.gather(*(repo.ping() for _ in range(WARMUP_CONNECTIONS)), return_exceptions=True)
+    indexes_ok = True
+    for name, fn in (("индексы игроков", repo.ensure_indexes), ("индексы состояния", shared.ensure_indexes),
+                     ("рейтинг", leaderboard.ensure_indexes)):
+        try:
+            await with_retry(name, fn)
+        except Exception as e:
+            indexes_ok = False
+            logging.error(f"Не удалось подготовить {name}: {e}")
+    checks["indexes"] = indexes_ok
+    try:
+        loaded = await preload_sessions()
+        checks["sessions"] = True
+        logging.info(f"Прогрев: {loaded} сессий, {time.perf_counter() - started:.2f} сек")
+    except Exception as e:
+        logging.error(f"Не удалось прогреть сессии: {e}")
+
+async def install_webhook():
+    try:
+        await with_retry("setWebhook", lambda: bot.set_webhook(WEBHOOK_URL))
+        checks["webhook"] = True
+        logging.info(f"Webhook установлен: {WEBHOOK_URL}")
+    except Exception as e:
+        logging.error(f"Не удалось установить webhook: {e}")
+
+def is_ready() -> bool:
+    return checks["mongo"]
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    body = {"status": "ready" if is_ready() else "starting", "checks": checks}
+    return JSONResponse(body, status_code=200 if is_ready() else 503)
+
 @app.on_event("startup")
 async def on_startup():
+    saver.start()
+    games.start()
+    outbox.start()
+    updates.start()
+    world.start()
+    run_in_background(warm_up())
     if WEBHOOK_URL:
-        await bot.set_webhook(WEBHOOK_URL)
-        logging.info(f"Webhook установлен: {WEBHOOK_URL}")
+        run_in_background(install_webhook())
     else:
         logging.warning("BASE_URL не задан — webhook не установлен")
 
@@ -426,10 +549,26 @@ async def on_startup():
 async def webhook(request: Request):
     if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TOKEN:
         raise HTTPException(status_code=403)
-    update = Update.model_validate(await request.json(), context={"bot": bot})
-    await dp.feed_update(bot, update)
+    try:
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+    except ValueError:
+        raise HTTPException(status_code=400)
+    # Отвечаем сразу; обработка идёт в пуле воркеров. Пока база не готова или
+    # очередь переполнена — 503, Telegram пришлёт апдейт ещё раз.
+    if not is_ready() or not await updates.submit(update):
+        raise HTTPException(status_code=503)
     return PlainTextResponse("OK")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await world.stop()
+    await updates.stop()
+    await outbox.stop()
+    await games.stop()
+    await saver.stop()
+    await repo.close()
+    await bot.session.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,140 @@
+import os
+from bisect import bisect_left
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+# Если задан — /metrics отдаётся только с заголовком Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Границы корзин гистограмм латентности, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# МЕТРИКИ
+# ──────────────────────────────────────────────────────────────────────────────
+# На горячем пути — только поиск корзины и пара сложений; текст собирается
+# при запросе /metrics.
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # метки -> [счётчики по корзинам (последняя — +Inf), сумма]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._series.items():
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {running}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {running}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, by: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + by
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Reading:
+    """Значение, которое читается из объектов приложения в момент запроса.
+
+    read() возвращает число или словарь {значение метки: число}.
+    """
+
+    def __init__(self, name: str, help: str, read, type: str = "gauge", label: str | None = None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.type = type
+        self.label = label
+
+    def samples(self):
+        value = self.read()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield f"{self.name}{_labels((self.label,), (key,))} {_number(item)}"
+        else:
+            yield f"{self.name} {_number(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"метрика {metric.name!r} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def reading(self, name: str, help: str, read, type: str = "gauge", label: str | None = None) -> Reading:
+        return self._add(Reading(name, help, read, type, label))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CALLBACK_SECONDS = REGISTRY.histogram(
+    "bot_callback_seconds", "Обработка callback'а целиком, по действиям", ("action",))
+MONGO_SECONDS = REGISTRY.histogram(
+    "bot_mongo_seconds", "Операции с коллекцией игроков", ("op",))
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "bot_telegram_seconds", "Вызовы Bot API из исходящей очереди", ("method",))
+TELEGRAM_ERRORS = REGISTRY.counter(
+    "bot_telegram_errors_total", "Ошибки вызовов Bot API (кроме flood control)", ("method",))
@@ -0,0 +1,63 @@
+# ──────────────────────────────────────────────────────────────────────────────
+# МАРШРУТИЗАЦИЯ CALLBACK'ОВ
+# ──────────────────────────────────────────────────────────────────────────────
+# Обработчик: handler(data, game, uid) -> (text, kb). text=None — экран не меняется.
+# Экран: render(game) -> (text, kb).
+
+
+class CallbackRouter:
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = []
+
+    def callback(self, *names: str):
+        def decorator(handler):
+            for name in names:
+                if name in self._exact:
+                    raise ValueError(f"callback {name!r} уже зарегистрирован")
+                self._exact[name] = handler
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str):
+        def decorator(handler):
+            self._prefixes.append((prefix, handler))
+            # Длинные префиксы проверяются первыми
+            self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            return handler
+        return decorator
+
+    def resolve(self, data: str):
+        return self.route(data)[1]
+
+    def route(self, data: str):
+        """(ключ маршрута, обработчик): ключ — сам callback или совпавший префикс.
+
+        Ключей конечное число, поэтому по ним можно группировать метрики.
+        """
+        handler = self._exact.get(data)
+        if handler is not None:
+            return data, handler
+        for prefix, handler in self._prefixes:
+            if data.startswith(prefix):
+                return prefix, handler
+        return None, None
+
+
+class ScreenRegistry:
+    def __init__(self, default: str = "main"):
+        self.default = default
+        self._screens = {}
+
+    def screen(self, name: str):
+        def decorator(render):
+            self._screens[name] = render
+            return render
+        return decorator
+
+    def __contains__(self, name: str):
+        return name in self._screens
+
+    def render(self, name: str, game):
+        render = self._screens.get(name) or self._screens[self.default]
+        return render(game)
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import TELEGRAM_ERRORS, TELEGRAM_SECONDS
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ (лимиты Telegram: ~30 запросов/с на бота, ~1 сообщение/с на чат)
+# ──────────────────────────────────────────────────────────────────────────────
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_GLOBAL_BURST = float(os.getenv("SEND_GLOBAL_BURST", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "16"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+DELETE_BATCH_LIMIT = 100  # максимум id в одном deleteMessages
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до появления целого токена (0 — можно сейчас)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("method", "kwargs", "key", "future", "attempts")
+
+    def __init__(self, method, kwargs: dict, key, future: asyncio.Future):
+        self.method = method
+        self.kwargs = kwargs
+        self.key = key
+        self.future = future
+        self.attempts = 0
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ЦЕНТРАЛЬНАЯ ОЧЕРЕДЬ ИСХОДЯЩИХ ЗАПРОСОВ
+# ──────────────────────────────────────────────────────────────────────────────
+class OutboundDispatcher:
+    """Очередь вызовов Bot API с глобальным и початовым token bucket.
+
+    Запросы одного чата выполняются строго по очереди. Если для одного
+    (chat_id, message_id) в очереди уже ждёт edit_message_text, новый вызов
+    просто подменяет его текст — уходит только последняя версия, а все
+    ожидающие получают её результат. TelegramRetryAfter ставит на паузу
+    всю очередь и возвращает запрос в начало очереди чата.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = SEND_GLOBAL_RATE,
+                 global_burst: float = SEND_GLOBAL_BURST, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, concurrency: int = SEND_CONCURRENCY,
+                 max_retries: int = SEND_MAX_RETRIES):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = None
+        self._global_rate = global_rate
+        self._global_burst = global_burst
+        self._buckets = {}  # chat_id -> TokenBucket
+        self._queues = {}  # chat_id -> deque[_Job]
+        self._ready = deque()  # чаты с запросами, у которых сейчас ничего не выполняется
+        self._edits = {}  # (chat_id, message_id) -> ждущий _Job
+        self._blocked_until = 0.0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()  # выполняющиеся запросы: держим ссылки, чтобы задачи не собрал GC
+        self.sent = 0
+        self.coalesced = 0
+        self.retry_after = 0
+
+    # ── публичные методы ─────────────────────────────────────────────────────
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int, reply_markup=None):
+        key = (chat_id, message_id)
+        kwargs = dict(text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+        job = self._edits.get(key)
+        if job is not None:
+            job.kwargs = kwargs
+            self.coalesced += 1
+            return await asyncio.shield(job.future)
+        return await self._submit(chat_id, self.bot.edit_message_text, kwargs, key)
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None):
+        kwargs = dict(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        return await self._submit(chat_id, self.bot.send_message, kwargs)
+
+    async def delete_message(self, chat_id: int, message_id: int):
+        kwargs = dict(chat_id=chat_id, message_id=message_id)
+        return await self._submit(chat_id, self.bot.delete_message, kwargs)
+
+    async def delete_messages(self, chat_id: int, message_ids: list[int]):
+        for i in range(0, len(message_ids), DELETE_BATCH_LIMIT):
+            kwargs = dict(chat_id=chat_id, message_ids=message_ids[i:i + DELETE_BATCH_LIMIT])
+            await self._submit(chat_id, self.bot.delete_messages, kwargs)
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    # ── очередь ──────────────────────────────────────────────────────────────
+    async def _submit(self, chat_id: int, method, kwargs: dict, key=None):
+        job = _Job(method, kwargs, key, asyncio.get_running_loop().create_future())
+        if key is not None:
+            self._edits[key] = job
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            self._ready.append(chat_id)
+        queue.append(job)
+        self._wakeup.set()
+        return await asyncio.shield(job.future)
+
+    def _bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def start(self):
+        if self._task is None:
+            loop = asyncio.get_running_loop()
+            self._global = TokenBucket(self._global_rate, self._global_burst, loop.time())
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                self._sweep_buckets(loop.time())
+                await self._wakeup.wait()
+                continue
+            now = loop.time()
+            wait = max(self._blocked_until - now, self._global.delay(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            chat_id, wait = self._pick_chat(now)
+            if chat_id is None:
+                # Все чаты упёрлись в свой лимит — ждём ближайшего или нового запроса
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            now = loop.time()
+            if now < self._blocked_until:
+                # Пока ждали слот, пришёл RetryAfter — чат ждёт конца паузы вместе со всеми
+                self._slots.release()
+                self._ready.appendleft(chat_id)
+                continue
+            self._global.take(now)
+            self._bucket(chat_id, now).take(now)
+            job = self._queues[chat_id].popleft()
+            if job.key is not None and self._edits.get(job.key) is job:
+                del self._edits[job.key]
+            task = asyncio.create_task(self._execute(chat_id, job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _pick_chat(self, now: float):
+        min_wait = None
+        for _ in range(len(self._ready)):
+            chat_id = self._ready.popleft()
+            wait = self._bucket(chat_id, now).delay(now)
+            if wait <= 0:
+                return chat_id, 0.0
+            self._ready.append(chat_id)
+            min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    async def _execute(self, chat_id: int, job: _Job):
+        method = job.method.__name__
+        started = time.perf_counter()
+        try:
+            result = await job.method(**job.kwargs)
+        except TelegramRetryAfter as e:
+            self.retry_after += 1
+            loop = asyncio.get_running_loop()
+            self._blocked_until = max(self._blocked_until, loop.time() + e.retry_after + 0.5)
+            logging.warning(f"Flood control: очередь на паузе {e.retry_after} сек")
+            self._requeue(chat_id, job, e)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(method)
+            job.future.set_exception(e)
+        else:
+            self.sent += 1
+            job.future.set_result(result)
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method)
+            queue = self._queues.get(chat_id)
+            if queue:
+                self._ready.append(chat_id)
+            else:
+                self._queues.pop(chat_id, None)
+            self._slots.release()
+            self._wakeup.set()
+
+    def _requeue(self, chat_id: int, job: _Job, error: Exception):
+        if job.key is not None:
+            newer = self._edits.get(job.key)
+            if newer is not None:
+                # Пока ждали, пришла более свежая правка — она и ответит за эту
+                newer.future.add_done_callback(lambda f: _copy_result(f, job.future))
+                return
+        job.attempts += 1
+        if job.attempts > self.max_retries:
+            logging.error(f"Запрос в чат {chat_id} отброшен после {job.attempts} попыток")
+            job.future.set_exception(error)
+            return
+        if job.key is not None:
+            self._edits[job.key] = job
+        self._queues.setdefault(chat_id, deque()).appendleft(job)
+
+    def _sweep_buckets(self, now: float):
+        # Полные вёдра без очереди ничего не ограничивают — их можно забыть
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._queues and b.is_full(now)]:
+            del self._buckets[chat_id]
+
+    async def stop(self, timeout: float = 10.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self._queues or self._edits) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _copy_result(source: asyncio.Future, target: asyncio.Future):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
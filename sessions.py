@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+SESSION_MAX_SIZE = int(os.getenv("SESSION_MAX_SIZE", "20000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# КЭШ СЕССИЙ (LRU + TTL ПРОСТОЯ)
+# ──────────────────────────────────────────────────────────────────────────────
+class SessionCache:
+    """Ограниченный кэш активных игр.
+
+    loader(uid) — корутина, поднимающая игру из базы при промахе.
+    on_evict(uid, game) — вызывается при вытеснении, чтобы игра ушла в базу.
+    """
+
+    def __init__(self, loader, on_evict, max_size: int = SESSION_MAX_SIZE,
+                 idle_ttl: float = SESSION_IDLE_TTL, sweep_interval: float = SESSION_SWEEP_INTERVAL):
+        self.loader = loader
+        self.on_evict = on_evict
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._items = OrderedDict()  # uid -> [game, last_access], старые в начале
+        self._loading = {}  # uid -> Future, чтобы не грузить одну игру дважды
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, uid):
+        return uid in self._items
+
+    def values(self):
+        return (entry[0] for entry in self._items.values())
+
+    def get(self, uid: int):
+        entry = self._items.get(uid)
+        if entry is None:
+            return None
+        entry[1] = time.monotonic()
+        self._items.move_to_end(uid)
+        return entry[0]
+
+    async def get_or_load(self, uid: int):
+        game = self.get(uid)
+        if game is not None:
+            self.hits += 1
+            return game
+        self.misses += 1
+        future = self._loading.get(uid)
+        if future is not None:
+            return await future
+        future = asyncio.get_running_loop().create_future()
+        self._loading[uid] = future
+        try:
+            game = await self.loader(uid)
+        except Exception as e:
+            self._loading.pop(uid, None)
+            future.set_exception(e)
+            future.exception()  # ждущих может не быть — не оставляем «непрочитанную» ошибку
+            raise
+        self._loading.pop(uid, None)
+        if game is not None:
+            if uid in self._items:  # пока грузили, игру уже положили (например, new_game)
+                game = self.get(uid)
+            else:
+                self.put(uid, game)
+        future.set_result(game)
+        return game
+
+    def put(self, uid: int, game):
+        self._items[uid] = [game, time.monotonic()]
+        self._items.move_to_end(uid)
+        while len(self._items) > self.max_size:
+            old_uid, (old_game, _) = self._items.popitem(last=False)
+            self._evict(old_uid, old_game)
+
+    def pop(self, uid: int):
+        entry = self._items.pop(uid, None)
+        return entry[0] if entry else None
+
+    def _evict(self, uid: int, game):
+        self.evictions += 1
+        try:
+            self.on_evict(uid, game)
+        except Exception as e:
+            logging.error(f"Ошибка при вытеснении сессии {uid}: {e}")
+
+    def sweep(self, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        expired = 0
+        # Порядок OrderedDict совпадает с порядком обращений — истёкшие всегда в начале
+        while self._items:
+            uid, (game, last_access) = next(iter(self._items.items()))
+            if now - last_access < self.idle_ttl:
+                break
+            del self._items[uid]
+            self._evict(uid, game)
+            expired += 1
+        return expired
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            expired = self.sweep()
+            if expired:
+                logging.info(f"Сессии: вытеснено по простою {expired}, в кэше {len(self._items)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Всё, что ещё в памяти, отдаём на сохранение
+        while self._items:
+            uid, (game, _) = self._items.popitem(last=False)
+            self.on_evict(uid, game)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ПОСЛЕДОВАТЕЛЬНАЯ ОБРАБОТКА ОДНОГО ИГРОКА
+# ──────────────────────────────────────────────────────────────────────────────
+class UserLocks:
+    """asyncio.Lock на игрока. Запись живёт, пока лок кто-то держит или ждёт,
+    поэтому память не растёт с числом игроков.
+    """
+
+    def __init__(self):
+        self._locks = {}  # uid -> [Lock, сколько корутин держат или ждут]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, uid: int):
+        entry = self._locks.get(uid)
+        if entry is None:
+            entry = self._locks[uid] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[uid]
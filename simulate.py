@@ -0,0 +1,540 @@
+"""Офлайн-симулятор баланса: миллионы засеянных партий за секунды.
+
+Состояние игроков лежит в массивах NumPy (по элементу на игрока), и каждый ход
+применяется ко всем партиям пакета разом. Правила берутся из самой игры:
+константы действий — из actions.py, стартовое состояние — из game.py,
+рецепты — из crafts.BOOK, истории — из data/story.json, погода и тик
+мира — из world.py. Поэтому правка баланса сразу видна в симуляции.
+
+Считаются день, к которому у игрока кончилась сытость или вода, экономика
+предметов (сколько найдено и сколько на руках в конце), карма, исходы
+историй и доля партий, застрявших без очков действий.
+
+    python simulate.py [--players 1000000] [--days 30] [--seed 1] [--out simulate.json]
+
+--check N дополнительно прогоняет N партий через настоящие обработчики
+(actions.router) с той же стратегией и печатает оба отчёта рядом — так
+видно, что векторный движок не разошёлся с игрой.
+
+Нужен numpy (pip install -r requirements-dev.txt); самому боту он не нужен.
+"""
+import argparse
+import datetime
+import json
+import math
+import random
+import time
+from collections import Counter
+
+import numpy as np
+
+from actions import (DAY_AP, DRINK_THIRST, EXPLORE_FINDS, RAIN_WATER, SLEEP_HP, SLEEP_HUNGER, SLEEP_THIRST,
+                     STAT_MAX, router)
+from crafts import BOOK
+from game import Game
+from keyboards import wolf_kb
+from stories import ENGINE, STORY_PATH
+from world import WEATHER_TRANSITIONS, WORLD_HUNGER_DECAY, WORLD_THIRST_DECAY, decayed, next_weather
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+SIM_CHUNK = 250_000  # партий в одном пакете массивов
+STORY_MAX_STEPS = 16  # защита от циклов в графе историй
+WATER = "Бутылка воды"
+TORCH = "Факел"  # единственный предмет, который можно надеть (см. handle_craft)
+ENTRY = "__entry__"  # узел встречи с волком: выборы — кнопки wolf_kb
+STATS = ("hp", "hunger", "thirst", "karma")
+
+
+class Policy:
+    """Как ходит симулированный игрок.
+
+    Каждый ход: пьёт, если вода ниже drink_below; ложится спать, когда очков
+    действий осталось sleep_at_ap или меньше (0 — исследует до упора, а спать
+    без очков игра не даёт); иначе исследует. Бесплатно собирает воду под
+    дождём, крафтит всё доступное (craft) и надевает факел.
+
+    encounter — шанс встретить волка при исследовании (один раз за партию),
+    choices — веса кнопок в историях (по умолчанию 1).
+    """
+
+    def __init__(self, sleep_at_ap: int = 1, drink_below: int = 50, craft: bool = True,
+                 encounter: float = 0.05, choices: dict | None = None):
+        self.sleep_at_ap = sleep_at_ap
+        self.drink_below = drink_below
+        self.craft = craft
+        self.encounter = encounter
+        self.choices = choices or {}
+
+    def weight(self, callback: str) -> float:
+        return float(self.choices.get(callback, 1.0))
+
+    def params(self) -> dict:
+        return {"sleep_at_ap": self.sleep_at_ap, "drink_below": self.drink_below, "craft": self.craft,
+                "encounter": self.encounter, "choices": self.choices}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ПРАВИЛА
+# ──────────────────────────────────────────────────────────────────────────────
+class _StoryStep:
+    __slots__ = ("callback", "states", "items", "equipped", "karma", "inventory", "equip", "next")
+
+
+class Rules:
+    """Правила игры, разложенные по индексам предметов, погоды и узлов историй."""
+
+    def __init__(self, ticks_per_day: int = 1, story_path: str = STORY_PATH):
+        with open(story_path, encoding="utf-8") as f:
+            story = json.load(f)
+        start = Game()
+        items = [*start.inventory, *EXPLORE_FINDS, TORCH]
+        for recipe in BOOK.ordered:
+            items += [item for item, _ in recipe.ingredients + recipe.result]
+        for tr in story.get("transitions", {}).values():
+            items += tr.get("requires", {}).get("items", {})
+            for effect in tr.get("effects", ()):
+                items += effect.get("inventory", {})
+                items += [item for item in effect.get("equip", {}).values() if item is not None]
+        self.items = list(dict.fromkeys(items))
+        self.index = {item: i for i, item in enumerate(self.items)}
+        self.water = self.index[WATER]
+        self.torch = self.index[TORCH]
+        self.finds = np.array([self.index[item] for item in EXPLORE_FINDS])
+        self.start_inventory = np.array([start.inventory.get(item, 0) for item in self.items], dtype=np.int32)
+        self.start = {name: getattr(start, name) for name in (*STATS, "ap", "day", "water_capacity")}
+        self.karma_goal = start.karma_goal
+
+        # Погода: строка матрицы — накопленные веса переходов из текущей погоды
+        self.weathers = list(WEATHER_TRANSITIONS)
+        weights = np.zeros((len(self.weathers), len(self.weathers)))
+        for i, current in enumerate(self.weathers):
+            for name, weight in WEATHER_TRANSITIONS[current]:
+                weights[i, self.weathers.index(name)] = weight
+        self.weather_cdf = np.cumsum(weights / weights.sum(axis=1, keepdims=True), axis=1)
+        self.start_weather = self.weathers.index(start.weather)
+        self.rain = self.weathers.index("rain")
+        self.ticks_per_day = ticks_per_day
+
+        self.recipes = [(r.id,
+                         np.array([self.index[i] for i, _ in r.ingredients]), np.array([n for _, n in r.ingredients]),
+                         np.array([self.index[i] for i, _ in r.result]), np.array([n for _, n in r.result]))
+                        for r in BOOK.ordered]
+        self._compile_story(story)
+
+    def _compile_story(self, story: dict):
+        nodes = story.get("nodes", {})
+        self.nodes = [ENTRY, *nodes]
+        node_index = {node: i for i, node in enumerate(self.nodes)}
+        node_index[None] = 0  # на кнопках встречи story_state ещё пуст
+        entry = [button.callback_data for row in wolf_kb.inline_keyboard for button in row]
+        self.choices = [entry] + [[c["callback"] for c in node.get("choices", ())] for node in nodes.values()]
+        self.equip_slots = {"hand"}
+        self.steps = {}
+        for callback, tr in story.get("transitions", {}).items():
+            step = _StoryStep()
+            step.callback = callback
+            requires = tr.get("requires", {})
+            states = requires.get("story_state")
+            step.states = None if states is None else np.array([node_index[s] for s in states if s in node_index])
+            step.items = [(self.index[item], count) for item, count in requires.get("items", {}).items()]
+            step.equipped = [(slot, self.index.get(item, -1)) for slot, item in requires.get("equipped", {}).items()]
+            step.karma = 0
+            step.inventory = []
+            step.equip = []
+            for effect in tr.get("effects", ()):
+                step.karma += effect.get("karma", 0)
+                step.inventory += [(self.index[item], delta) for item, delta in effect.get("inventory", {}).items()]
+                step.equip += [(slot, -1 if item is None else self.index[item])
+                               for slot, item in effect.get("equip", {}).items()]
+            self.equip_slots |= {slot for slot, _ in step.equipped + step.equip}
+            next_node = tr.get("next")
+            step.next = -1 if next_node is None else node_index[next_node]
+            self.steps[callback] = step
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ИТОГИ
+# ──────────────────────────────────────────────────────────────────────────────
+class Tally:
+    """Итоги партий, которые складываются между пакетами без хранения самих партий."""
+
+    def __init__(self, rules: Rules, days: int):
+        self.rules = rules
+        self.days = days
+        self.players = 0
+        self.exhausted = np.zeros(days + 2, dtype=np.int64)  # по дню; 0 — дотянул до конца
+        self.stuck = 0
+        self.karma = Counter()
+        self.stats = dict.fromkeys(STATS, 0)
+        self.found = np.zeros(len(rules.items), dtype=np.int64)
+        self.held = np.zeros(len(rules.items), dtype=np.int64)
+        self.held_any = np.zeros(len(rules.items), dtype=np.int64)
+        self.crafted = Counter()
+        self.story = Counter()
+
+    def add(self, state: dict, exhausted, stuck):
+        self.players += len(exhausted)
+        self.exhausted += np.bincount(exhausted, minlength=self.days + 2)
+        self.stuck += int(np.count_nonzero(stuck))
+        values, counts = np.unique(state["karma"], return_counts=True)
+        self.karma.update(dict(zip(values.tolist(), counts.tolist())))
+        for name in STATS:
+            self.stats[name] += int(state[name].sum())
+        self.held += state["inventory"].sum(axis=1)
+        self.held_any += np.count_nonzero(state["inventory"], axis=1)
+
+    def _day_percentile(self, p: float) -> int:
+        counts = self.exhausted[1:]
+        total = counts.sum()
+        if not total:
+            return 0
+        return int(np.searchsorted(np.cumsum(counts), math.ceil(p / 100 * total))) + 1
+
+    def report(self) -> dict:
+        n = max(self.players, 1)
+        karma = sorted(self.karma.items())
+        return {
+            "players": self.players,
+            "exhausted": {
+                "share": round(1 - self.exhausted[0] / n, 4),
+                "p10_day": self._day_percentile(10),
+                "p50_day": self._day_percentile(50),
+                "p90_day": self._day_percentile(90),
+                "by_day": {day: int(c) for day, c in enumerate(self.exhausted) if day and c},
+            },
+            "stuck_share": round(self.stuck / n, 4),
+            "final_mean": {name: round(total / n, 2) for name, total in self.stats.items()},
+            "karma": {
+                "goal": self.rules.karma_goal,
+                "goal_share": round(sum(c for k, c in karma if k >= self.rules.karma_goal) / n, 4),
+                "by_value": {k: c for k, c in karma},
+            },
+            "items": {item: {"found_per_player": round(int(self.found[i]) / n, 3),
+                             "held_mean": round(int(self.held[i]) / n, 3),
+                             "held_share": round(int(self.held_any[i]) / n, 4)}
+                      for i, item in enumerate(self.rules.items)},
+            "crafted_per_player": {k: round(v / n, 4) for k, v in self.crafted.items()},
+            "story_share": {k: round(v / n, 4) for k, v in self.story.items()},
+        }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ВЕКТОРНЫЙ ДВИЖОК
+# ──────────────────────────────────────────────────────────────────────────────
+class Batch:
+    """Пакет из n партий: каждое поле Game — массив по игрокам.
+
+    Инвентарь лежит по предметам (строка — предмет), так что работа с одним
+    предметом идёт по непрерывной памяти. Ходы применяются масками ко всему
+    пакету, без выборки строк: на каждом ходу действует почти каждый игрок.
+    """
+
+    def __init__(self, rules: Rules, policy: Policy, n: int, rng: np.random.Generator, tally: Tally):
+        self.rules = rules
+        self.policy = policy
+        self.n = n
+        self.rng = rng
+        self.tally = tally
+        self.s = {name: np.full(n, value, dtype=np.int32) for name, value in rules.start.items()}
+        self.s["weather"] = np.full(n, rules.start_weather, dtype=np.int8)
+        self.s["inventory"] = np.repeat(rules.start_inventory[:, None], n, axis=1)
+        self.equip = {slot: np.full(n, -1, dtype=np.int32) for slot in rules.equip_slots}
+        self.met = np.zeros(n, dtype=bool)
+        self.stuck = np.zeros(n, dtype=bool)
+        self.exhausted = np.zeros(n, dtype=np.int64)
+
+    def run(self, days: int):
+        s = self.s
+        # Больше ходов за день не бывает: все очки, глотки до порога и сон
+        per_day = DAY_AP + math.ceil(STAT_MAX / DRINK_THIRST) + 1
+        for _ in range(days * per_day + 1):
+            active = (s["day"] <= days) & ~self.stuck
+            if not active.any():
+                break
+            self._free_actions(active)
+            ap = s["ap"]
+            self.stuck |= active & (ap <= 0)
+            acting = active & (ap > 0)
+            drink = acting & (s["thirst"] < self.policy.drink_below) & (s["inventory"][self.rules.water] > 0)
+            acting &= ~drink
+            sleep = acting & (ap <= self.policy.sleep_at_ap)
+            self._drink(drink)
+            self._sleep(sleep)
+            self._explore(acting & ~sleep)
+        self.tally.add(s, self.exhausted, self.stuck)
+
+    def _free_actions(self, active):
+        s, rules = self.s, self.rules
+        inv = s["inventory"]
+        # action_collect_water не тратит очков действий
+        water, capacity = inv[rules.water], s["water_capacity"]
+        collect = active & (s["weather"] == rules.rain) & (water < capacity)
+        np.add(water, np.minimum(RAIN_WATER, capacity - water), out=water, where=collect)
+        if self.policy.craft:
+            for recipe_id, ingredients, counts, results, made in rules.recipes:
+                can = active.copy()
+                for item, count in zip(ingredients, counts):
+                    can &= inv[item] >= count
+                crafted = int(np.count_nonzero(can))
+                if crafted:
+                    for item, count in zip(ingredients, counts):
+                        np.subtract(inv[item], count, out=inv[item], where=can)
+                    for item, count in zip(results, made):
+                        np.add(inv[item], count, out=inv[item], where=can)
+                    self.tally.crafted[recipe_id] += crafted
+        hand = self.equip["hand"]
+        equip = active & (inv[rules.torch] > 0) & (hand == -1)
+        np.subtract(inv[rules.torch], 1, out=inv[rules.torch], where=equip)
+        hand[equip] = rules.torch
+
+    def _drink(self, mask):
+        # Пьющих и спящих на ходу немного — их удобнее менять по номерам строк
+        rows = np.flatnonzero(mask)
+        s = self.s
+        s["inventory"][self.rules.water, rows] -= 1
+        s["thirst"][rows] = np.minimum(STAT_MAX, s["thirst"][rows] + DRINK_THIRST)
+
+    def _sleep(self, mask):
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return
+        s, rules = self.s, self.rules
+        s["hp"][rows] = np.minimum(STAT_MAX, s["hp"][rows] + SLEEP_HP)
+        hunger = np.maximum(0, s["hunger"][rows] - SLEEP_HUNGER)
+        thirst = np.maximum(0, s["thirst"][rows] - SLEEP_THIRST)
+        weather = s["weather"][rows]
+        for _ in range(rules.ticks_per_day):
+            u = self.rng.random(len(rows))[:, None]
+            weather = np.minimum((rules.weather_cdf[weather] <= u).sum(axis=1), len(rules.weathers) - 1)
+            hunger = np.maximum(0, hunger - WORLD_HUNGER_DECAY)
+            thirst = np.maximum(0, thirst - WORLD_THIRST_DECAY)
+        s["weather"][rows] = weather
+        s["hunger"][rows] = hunger
+        s["thirst"][rows] = thirst
+        s["day"][rows] += 1
+        s["ap"][rows] = DAY_AP
+        fresh = rows[(self.exhausted[rows] == 0) & ((hunger == 0) | (thirst == 0))]
+        self.exhausted[fresh] = s["day"][fresh]
+
+    def _explore(self, mask):
+        s, rules = self.s, self.rules
+        s["ap"] -= mask
+        found = self.rng.integers(len(rules.finds), size=self.n, dtype=np.int8)
+        for i, item in enumerate(rules.finds):
+            hit = mask & (found == i)
+            s["inventory"][item] += hit
+            self.tally.found[item] += int(np.count_nonzero(hit))
+        if self.policy.encounter > 0:
+            meet = np.flatnonzero(mask & ~self.met & (self.rng.random(self.n) < self.policy.encounter))
+            self.met[meet] = True
+            self._story(meet)
+
+    def _available(self, step: _StoryStep, rows, at: int):
+        ok = np.ones(len(rows), dtype=bool)
+        if step.states is not None and at not in step.states:
+            ok[:] = False
+        for item, count in step.items:
+            ok &= self.s["inventory"][item, rows] >= count
+        for slot, item in step.equipped:
+            ok &= self.equip[slot][rows] == item
+        return ok
+
+    def _story(self, rows):
+        s, rules = self.s, self.rules
+        at = np.zeros(len(rows), dtype=np.int32)  # узел ENTRY
+        for _ in range(STORY_MAX_STEPS):
+            live = at >= 0
+            if not live.any():
+                break
+            for node in np.unique(at[live]).tolist():
+                here = np.flatnonzero(at == node)
+                players = rows[here]
+                steps = [rules.steps[c] for c in rules.choices[node] if c in rules.steps]
+                if not steps:
+                    at[here] = -1
+                    continue
+                weights = np.stack([self._available(step, players, node) * self.policy.weight(step.callback)
+                                    for step in steps], axis=1)
+                total = weights.sum(axis=1)
+                at[here[total == 0]] = -1
+                u = self.rng.random(len(here)) * total
+                pick = (np.cumsum(weights, axis=1) <= u[:, None]).sum(axis=1)
+                for i, step in enumerate(steps):
+                    chosen = (pick == i) & (total > 0)
+                    who = players[chosen]
+                    if not len(who):
+                        continue
+                    s["karma"][who] += step.karma
+                    for item, delta in step.inventory:
+                        s["inventory"][item, who] = np.maximum(0, s["inventory"][item, who] + delta)
+                    for slot, item in step.equip:
+                        self.equip[slot][who] = item
+                    at[here[chosen]] = step.next
+                    self.tally.story[step.callback] += len(who)
+
+
+def simulate(players: int, days: int, seed: int, policy: Policy, rules: Rules,
+             chunk: int = SIM_CHUNK) -> Tally:
+    tally = Tally(rules, days)
+    sizes = [min(chunk, players - start) for start in range(0, players, chunk)]
+    # Каждый пакет — свой поток случайных чисел: итог зависит только от seed и chunk
+    for n, stream in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))):
+        Batch(rules, policy, n, np.random.default_rng(stream), tally).run(days)
+    return tally
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# СВЕРКА С НАСТОЯЩИМИ ОБРАБОТЧИКАМИ
+# ──────────────────────────────────────────────────────────────────────────────
+def _press(game, data: str):
+    router.resolve(data)(data, game, 0)
+
+
+def play_reference(rules: Rules, policy: Policy, days: int, rng: random.Random, tally: Tally) -> tuple[Game, int, bool]:
+    """Одна партия через actions.router — та же стратегия, но по одному нажатию."""
+    game = Game()
+    met = False
+    exhausted = 0
+    while game.day <= days:
+        if game.weather == "rain" and game.inventory[WATER] < game.water_capacity:
+            _press(game, "action_collect_water")
+        if policy.craft:
+            for recipe in BOOK.ordered:
+                if recipe.can_craft(game.inventory):
+                    _press(game, f"craft_{recipe.id}")
+                    tally.crafted[recipe.id] += 1
+        if game.inventory.get(TORCH, 0) > 0 and game.equipment["hand"] is None:
+            _press(game, f"use_item_{TORCH}")
+        if game.ap <= 0:
+            return game, exhausted, True
+        if game.thirst < policy.drink_below and game.inventory[WATER] > 0:
+            _press(game, "action_3")
+        elif game.ap <= policy.sleep_at_ap:
+            _press(game, "action_4")
+            for _ in range(rules.ticks_per_day):
+                game.weather = next_weather(game.weather, rng)
+                game.hunger = decayed(game.hunger, WORLD_HUNGER_DECAY)
+                game.thirst = decayed(game.thirst, WORLD_THIRST_DECAY)
+            if not exhausted and (game.hunger == 0 or game.thirst == 0):
+                exhausted = game.day
+        else:
+            before = {item: game.inventory[item] for item in EXPLORE_FINDS}
+            _press(game, "action_1")
+            for item in EXPLORE_FINDS:
+                tally.found[rules.index[item]] += game.inventory[item] - before[item]
+            if not met and policy.encounter > 0 and rng.random() < policy.encounter:
+                met = True
+                _play_story(game, rules, policy, rng, tally)
+    return game, exhausted, False
+
+
+def _play_story(game, rules: Rules, policy: Policy, rng: random.Random, tally: Tally):
+    choices = rules.choices[0]
+    for _ in range(STORY_MAX_STEPS):
+        options = [c for c in choices if c in ENGINE.transitions
+                   and all(check(game) for check in ENGINE.transitions[c].requires)]
+        weights = [policy.weight(c) for c in options]
+        if not options or sum(weights) <= 0:
+            return
+        data = rng.choices(options, weights=weights)[0]
+        _press(game, data)
+        tally.story[data] += 1
+        if game.story_state is None:
+            return
+        choices = rules.choices[rules.nodes.index(game.story_state)]
+
+
+def check(players: int, days: int, seed: int, policy: Policy, rules: Rules) -> Tally:
+    rng = random.Random(seed)
+    random.seed(seed)  # находки action_1 берутся из модуля random
+    tally = Tally(rules, days)
+    results = [play_reference(rules, policy, days, rng, tally) for _ in range(players)]
+    games = [game for game, _, _ in results]
+    state = {name: np.array([getattr(g, name) for g in games]) for name in STATS}
+    state["inventory"] = np.array([[g.inventory.get(item, 0) for g in games] for item in rules.items])
+    tally.add(state, np.array([e for _, e, _ in results], dtype=np.int64), np.array([s for _, _, s in results]))
+    return tally
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ЗАПУСК
+# ──────────────────────────────────────────────────────────────────────────────
+def print_report(title: str, report: dict, other: dict | None = None):
+    def pair(value, key_path):
+        if other is None:
+            return f"{value}"
+        ref = other
+        for key in key_path:
+            ref = ref.get(key, 0) if isinstance(ref, dict) else 0
+        return f"{value}  (обработчики: {ref})"
+
+    ex = report["exhausted"]
+    print(f"── {title}: {report['players']} партий")
+    print(f"обессилели:          {pair(ex['share'], ('exhausted', 'share'))}")
+    print(f"день p10/p50/p90:    {ex['p10_day']}/{ex['p50_day']}/{ex['p90_day']}"
+          + ("" if other is None else "  (обработчики: {p10_day}/{p50_day}/{p90_day})".format(**other["exhausted"])))
+    print(f"застряли без ОД:     {pair(report['stuck_share'], ('stuck_share',))}")
+    for name, value in report["final_mean"].items():
+        print(f"{name + ' в конце:':<20} {pair(value, ('final_mean', name))}")
+    print(f"карма >= {report['karma']['goal']}:        {pair(report['karma']['goal_share'], ('karma', 'goal_share'))}")
+    for item, row in report["items"].items():
+        if row["found_per_player"] or row["held_mean"]:
+            found = pair(row["found_per_player"], ("items", item, "found_per_player"))
+            held = pair(row["held_mean"], ("items", item, "held_mean"))
+            print(f"{item.strip() + ':':<20} найдено {found}, на руках {held}")
+    for name, value in report["story_share"].items():
+        print(f"{'история ' + name + ':':<20} {pair(value, ('story_share', name))}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--chunk", type=int, default=SIM_CHUNK, help="партий в одном пакете массивов")
+    parser.add_argument("--ticks-per-day", type=int, default=1,
+                        help="тиков мира (погода, голод, жажда) за игровой день; в боте тик идёт по часам")
+    parser.add_argument("--sleep-at-ap", type=int, default=1)
+    parser.add_argument("--drink-below", type=int, default=50)
+    parser.add_argument("--no-craft", action="store_true")
+    parser.add_argument("--encounter", type=float, default=0.05, help="шанс встретить волка при исследовании")
+    parser.add_argument("--choice", action="append", default=[], metavar="CALLBACK=ВЕС",
+                        help="вес кнопки в историях, например wolf_fight=3")
+    parser.add_argument("--check", type=int, default=0, help="сверить с N партиями через обработчики")
+    parser.add_argument("--out", default=None, help="записать отчёт в JSON")
+    args = parser.parse_args()
+
+    choices = {}
+    for item in args.choice:
+        callback, _, weight = item.partition("=")
+        choices[callback] = float(weight)
+    policy = Policy(args.sleep_at_ap, args.drink_below, not args.no_craft, args.encounter, choices)
+    rules = Rules(args.ticks_per_day)
+
+    started = time.perf_counter()
+    report = simulate(args.players, args.days, args.seed, policy, rules, args.chunk).report()
+    elapsed = time.perf_counter() - started
+    reference = None
+    if args.check:
+        reference = check(args.check, args.days, args.seed, policy, rules).report()
+    print_report(f"{args.days} дней", report, reference)
+    print(f"время:               {elapsed:.2f} сек ({args.players / elapsed:,.0f} партий/с)")
+
+    if args.out:
+        result = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "params": {"players": args.players, "days": args.days, "seed": args.seed, "chunk": args.chunk,
+                       "ticks_per_day": args.ticks_per_day, "policy": policy.params()},
+            "elapsed_s": round(elapsed, 3),
+            "report": report,
+            "reference": reference,
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"отчёт записан в {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
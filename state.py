@@ -0,0 +1,275 @@
+import os
+import socket
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from throttle import GcraTable
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+# memory — всё в памяти процесса (один воркер, тесты), mongo — общее для всех воркеров
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_TTL = float(os.getenv("STATE_TTL", str(7 * 24 * 3600)))  # сколько хранить состояние неактивных
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL", "5"))  # локальный кэш перед общим хранилищем
+STATE_SWEEP_INTERVAL = float(os.getenv("STATE_SWEEP_INTERVAL", "600"))  # чистка памяти в режиме memory
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ИНТЕРФЕЙС
+# ──────────────────────────────────────────────────────────────────────────────
+class StateBackend:
+    """Служебное состояние игроков и чатов, общее для всех воркеров.
+
+    screen — что сейчас на экране у игрока: {"msg": message_id, "fp": отпечаток}.
+    Все операции, где важна атомарность (take, claim_session, pop_tracked),
+    выполняются хранилищем за один шаг.
+    """
+
+    async def take(self, uid: int, cost: float, rate: float, burst: float) -> bool:
+        """Списывает cost токенов из ведра игрока. False — ведро пусто, запрос отклонён."""
+        raise NotImplementedError
+
+    async def claim_session(self, uid: int, owner: str) -> str | None:
+        """Делает owner владельцем сессии и возвращает предыдущего владельца."""
+        raise NotImplementedError
+
+    async def get_screen(self, uid: int) -> dict | None:
+        raise NotImplementedError
+
+    async def set_screen(self, uid: int, msg_id: int, fingerprint: int):
+        raise NotImplementedError
+
+    async def clear_screen(self, uid: int):
+        raise NotImplementedError
+
+    async def track_message(self, chat_id: int, msg_id: int, limit: int):
+        raise NotImplementedError
+
+    async def pop_tracked(self, chat_id: int) -> list[int]:
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# В ПАМЯТИ (ОДИН ПРОЦЕСС / ТЕСТЫ)
+# ──────────────────────────────────────────────────────────────────────────────
+class MemoryStateBackend(StateBackend):
+    """Состояние в словарях процесса.
+
+    Экраны и списки сообщений неактивных игроков и чатов удаляются через ttl —
+    как TTL-индексом в MongoStateBackend, — поэтому память не растёт с числом
+    когда-либо заходивших игроков.
+    """
+
+    def __init__(self, ttl: float = STATE_TTL, sweep_interval: float = STATE_SWEEP_INTERVAL):
+        self.buckets = GcraTable()
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.screens = {}  # uid -> (screen, истекает)
+        self.tracked = {}  # chat_id -> (deque id сообщений, истекает)
+        self._next_sweep = 0.0
+
+    def _expires(self) -> float:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.sweep(now)
+        return now + self.ttl
+
+    def sweep(self, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        removed = 0
+        for table in (self.screens, self.tracked):
+            expired = [key for key, (_, expires) in table.items() if expires <= now]
+            for key in expired:
+                del table[key]
+            removed += len(expired)
+        self._next_sweep = now + self.sweep_interval
+        return removed
+
+    async def take(self, uid: int, cost: float, rate: float, burst: float) -> bool:
+        return self.buckets.take(uid, cost, rate, burst)
+
+    async def claim_session(self, uid: int, owner: str) -> str | None:
+        # Процесс один — все сессии и так его, хранить владельцев незачем
+        return owner
+
+    async def get_screen(self, uid: int) -> dict | None:
+        entry = self.screens.get(uid)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    async def set_screen(self, uid: int, msg_id: int, fingerprint: int):
+        self.screens[uid] = ({"msg": msg_id, "fp": fingerprint}, self._expires())
+
+    async def clear_screen(self, uid: int):
+        self.screens.pop(uid, None)
+
+    async def track_message(self, chat_id: int, msg_id: int, limit: int):
+        entry = self.tracked.get(chat_id)
+        ids = entry[0] if entry is not None else deque(maxlen=limit)
+        ids.append(msg_id)
+        self.tracked[chat_id] = (ids, self._expires())
+
+    async def pop_tracked(self, chat_id: int) -> list[int]:
+        entry = self.tracked.pop(chat_id, None)
+        return list(entry[0]) if entry is not None else []
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# MONGODB (НЕСКОЛЬКО ВОРКЕРОВ / ИНСТАНСОВ)
+# ──────────────────────────────────────────────────────────────────────────────
+class MongoStateBackend(StateBackend):
+    """Состояние в коллекциях user_state и chat_state.
+
+    Документы неактивных игроков удаляет TTL-индекс по expires_at.
+    """
+
+    def __init__(self, db, ttl: float = STATE_TTL):
+        self.users = db["user_state"]
+        self.chats = db["chat_state"]
+        self.ttl = ttl
+
+    def _expires(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+
+    async def ensure_indexes(self):
+        await self.users.create_index("expires_at", expireAfterSeconds=0)
+        await self.chats.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, uid: int, cost: float, rate: float, burst: float) -> bool:
+        # GCRA одним запросом: документ найдётся, только если в ведре хватает
+        # токенов (tat + cost/rate - now <= burst/rate); иначе upsert упрётся в _id
+        now = time.time()
+        step = cost / rate
+        try:
+            await self.users.update_one(
+                {"_id": uid, "$or": [{"tat": {"$lte": now + burst / rate - step}}, {"tat": {"$exists": False}}]},
+                [{"$set": {
+                    "tat": {"$add": [{"$max": [{"$ifNull": ["$tat", now]}, now]}, step]},
+                    "expires_at": self._expires(),
+                }}],
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def claim_session(self, uid: int, owner: str) -> str | None:
+        # Пишем, только если владелец меняется: свою сессию фильтр не найдёт, и
+        # upsert упрётся в _id без записи. expires_at продлевают take и set_screen
+        try:
+            doc = await self.users.find_one_and_update(
+                {"_id": uid, "owner": {"$ne": owner}},
+                {"$set": {"owner": owner, "expires_at": self._expires()}},
+                projection={"owner": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            return owner
+        return doc.get("owner") if doc else None
+
+    async def get_screen(self, uid: int) -> dict | None:
+        doc = await self.users.find_one({"_id": uid}, {"screen": 1})
+        return doc.get("screen") if doc else None
+
+    async def set_screen(self, uid: int, msg_id: int, fingerprint: int):
+        await self.users.update_one(
+            {"_id": uid},
+            {"$set": {"screen": {"msg": msg_id, "fp": fingerprint}, "expires_at": self._expires()}},
+            upsert=True
+        )
+
+    async def clear_screen(self, uid: int):
+        await self.users.update_one({"_id": uid}, {"$unset": {"screen": ""}})
+
+    async def track_message(self, chat_id: int, msg_id: int, limit: int):
+        await self.chats.update_one(
+            {"_id": chat_id},
+            {"$push": {"tracked": {"$each": [msg_id], "$slice": -limit}},
+             "$set": {"expires_at": self._expires()}},
+            upsert=True
+        )
+
+    async def pop_tracked(self, chat_id: int) -> list[int]:
+        doc = await self.chats.find_one_and_update(
+            {"_id": chat_id},
+            {"$unset": {"tracked": ""}},
+            projection={"tracked": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        return doc.get("tracked", []) if doc else []
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ЛОКАЛЬНЫЙ КЭШ ПЕРЕД ОБЩИМ ХРАНИЛИЩЕМ
+# ──────────────────────────────────────────────────────────────────────────────
+class CachedStateBackend(StateBackend):
+    """Кэширует screen на STATE_CACHE_TTL секунд; запись — сквозная.
+
+    Устаревший screen безопасен: в худшем случае edit уйдёт в старое
+    сообщение, получит BadRequest, и бот отправит новое.
+    """
+
+    def __init__(self, inner: StateBackend, ttl: float = STATE_CACHE_TTL, max_size: int = 50000):
+        self.inner = inner
+        self.ttl = ttl
+        self.max_size = max_size
+        self._screens = {}  # uid -> (screen, expires_at)
+
+    def _remember(self, uid: int, screen):
+        if len(self._screens) >= self.max_size:
+            self._screens.clear()
+        self._screens[uid] = (screen, time.monotonic() + self.ttl)
+
+    async def take(self, uid: int, cost: float, rate: float, burst: float) -> bool:
+        return await self.inner.take(uid, cost, rate, burst)
+
+    async def claim_session(self, uid: int, owner: str) -> str | None:
+        previous = await self.inner.claim_session(uid, owner)
+        if previous is not None and previous != owner:
+            self._screens.pop(uid, None)  # игрок побывал на другом воркере
+        return previous
+
+    async def get_screen(self, uid: int) -> dict | None:
+        cached = self._screens.get(uid)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        screen = await self.inner.get_screen(uid)
+        self._remember(uid, screen)
+        return screen
+
+    async def set_screen(self, uid: int, msg_id: int, fingerprint: int):
+        await self.inner.set_screen(uid, msg_id, fingerprint)
+        self._remember(uid, {"msg": msg_id, "fp": fingerprint})
+
+    async def clear_screen(self, uid: int):
+        await self.inner.clear_screen(uid)
+        self._remember(uid, None)
+
+    async def track_message(self, chat_id: int, msg_id: int, limit: int):
+        await self.inner.track_message(chat_id, msg_id, limit)
+
+    async def pop_tracked(self, chat_id: int) -> list[int]:
+        return await self.inner.pop_tracked(chat_id)
+
+    async def ensure_indexes(self):
+        await self.inner.ensure_indexes()
+
+
+def make_state_backend(db) -> StateBackend:
+    if STATE_BACKEND == "mongo":
+        return CachedStateBackend(MongoStateBackend(db))
+    if STATE_BACKEND == "memory":
+        return MemoryStateBackend()
+    raise ValueError(f"Неизвестный STATE_BACKEND: {STATE_BACKEND}")
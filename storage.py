@@ -0,0 +1,415 @@
+import asyncio
+import logging
+import os
+import time
+from itertools import islice
+
+from pymongo import AsyncMongoClient, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from metrics import MONGO_SECONDS
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ ПУЛА / ТАЙМАУТОВ
+# ──────────────────────────────────────────────────────────────────────────────
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SELECT_TIMEOUT_MS = int(os.getenv("MONGO_SELECT_TIMEOUT_MS", "5000"))
+# Общий лимит на одну операцию (client side operation timeout)
+MONGO_OP_TIMEOUT_MS = int(os.getenv("MONGO_OP_TIMEOUT_MS", "2000"))
+
+# Отложенная запись: максимальная задержка и размер пачки bulk_write
+SAVE_MAX_DELAY = float(os.getenv("SAVE_MAX_DELAY", "2.0"))
+SAVE_BATCH_SIZE = int(os.getenv("SAVE_BATCH_SIZE", "500"))
+# Сколько раз переигрывать запись, если документ успел изменить другой воркер
+SAVE_CAS_RETRIES = int(os.getenv("SAVE_CAS_RETRIES", "3"))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ИНТЕРФЕЙС РЕПОЗИТОРИЯ
+# ──────────────────────────────────────────────────────────────────────────────
+class PlayerRepository:
+    """Хранилище документов игроков. Все методы — корутины.
+
+    Запись — compare-and-swap по полю документа v: update применяется, только
+    если в базе всё ещё версия version, и увеличивает v на 1. Документ без v
+    считается версией 0.
+    """
+
+    async def ping(self):
+        raise NotImplementedError
+
+    async def load(self, uid: int) -> dict | None:
+        raise NotImplementedError
+
+    async def update(self, uid: int, update: dict, version: int) -> bool:
+        """False — версия в базе уже другая, ничего не записано."""
+        raise NotImplementedError
+
+    async def update_many(self, items: list[tuple[int, dict, int]]) -> list[int]:
+        """Пакетная запись; возвращает uid, на которых не совпала версия."""
+        conflicts = []
+        for uid, update, version in items:
+            if not await self.update(uid, update, version):
+                conflicts.append(uid)
+        return conflicts
+
+    async def load_many(self, uids: list[int]) -> dict[int, dict]:
+        """Документы нескольких игроков: uid -> документ (нет документа — нет ключа)."""
+        docs = {}
+        for uid in uids:
+            doc = await self.load(uid)
+            if doc is not None:
+                docs[uid] = doc
+        return docs
+
+    async def versions(self, uids: list[int]) -> dict[int, int]:
+        raise NotImplementedError
+
+    def note_action(self, uid: int, action: str):
+        """Действие игрока, которое войдёт в следующую запись (хранит только журнал)."""
+
+    async def ensure_indexes(self):
+        pass
+
+    async def recent(self, limit: int) -> list[dict]:
+        """Документы игроков, которые сохранялись последними (для прогрева кэша)."""
+        return []
+
+    async def close(self):
+        pass
+
+
+def _version_filter(uid: int, version: int) -> dict:
+    # v: null совпадает и с отсутствующим полем — так подхватываются старые документы
+    return {"_id": uid, "v": version if version else {"$in": [None, 0]}}
+
+
+def _versioned(update: dict) -> dict:
+    inc = dict(update.get("$inc", ()))
+    inc["v"] = 1
+    # seen — время последней записи: по нему при старте прогревается кэш сессий
+    return {**update, "$inc": inc, "$currentDate": {"seen": True}}
+
+
+class MongoPlayerRepository(PlayerRepository):
+    def __init__(self, uri: str, db_name: str = "forest_game"):
+        self.client = AsyncMongoClient(
+            uri,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SELECT_TIMEOUT_MS,
+            timeoutMS=MONGO_OP_TIMEOUT_MS,
+        )
+        self.db = self.client[db_name]
+        self.players = self.db["players"]
+
+    async def ping(self):
+        await self.client.admin.command("ping")
+
+    async def load(self, uid: int) -> dict | None:
+        return await self.players.find_one({"_id": uid})
+
+    async def load_many(self, uids: list[int]) -> dict[int, dict]:
+        return {doc["_id"]: doc async for doc in self.players.find({"_id": {"$in": list(uids)}})}
+
+    async def ensure_indexes(self):
+        await self.players.create_index([("seen", DESCENDING)])
+
+    async def recent(self, limit: int) -> list[dict]:
+        cursor = self.players.find({"seen": {"$exists": True}}).sort("seen", DESCENDING).limit(limit)
+        return [doc async for doc in cursor]
+
+    # Если версия не совпала, фильтр ничего не находит и upsert пытается вставить
+    # документ с тем же _id — это DuplicateKeyError, то есть конфликт версий
+    async def update(self, uid: int, update: dict, version: int) -> bool:
+        try:
+            await self.players.update_one(_version_filter(uid, version), _versioned(update), upsert=True)
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def update_many(self, items: list[tuple[int, dict, int]]) -> list[int]:
+        ops = [UpdateOne(_version_filter(uid, version), _versioned(update), upsert=True)
+               for uid, update, version in items]
+        if not ops:
+            return []
+        try:
+            await self.players.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            conflicts = [items[err["index"]][0] for err in errors if err.get("code") == 11000]
+            if len(conflicts) < len(errors):
+                raise
+            return conflicts
+        return []
+
+    async def versions(self, uids: list[int]) -> dict[int, int]:
+        cursor = self.players.find({"_id": {"$in": list(uids)}}, {"v": 1})
+        return {doc["_id"]: doc.get("v", 0) async for doc in cursor}
+
+    async def close(self):
+        await self.client.close()
+        logging.info("MongoDB соединение закрыто")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ДЕЛЬТА-СОХРАНЕНИЯ
+# ──────────────────────────────────────────────────────────────────────────────
+def _safe_key(key) -> bool:
+    return isinstance(key, str) and key and "." not in key and not key.startswith("$")
+
+def build_delta(saved: dict | None, state: dict, log_new: int, log_limit: int) -> dict | None:
+    """Собирает update-документ из разницы между сохранённым и текущим состоянием.
+
+    saved=None означает, что в базе ничего нет (или состояние неизвестно) —
+    тогда game_data переписывается целиком. Возвращает None, если менять нечего.
+    """
+    if saved is None:
+        return {"$set": {"game_data": state}}
+    sets, incs, push = {}, {}, {}
+    for key, value in state.items():
+        old = saved.get(key)
+        if value == old:
+            continue
+        path = f"game_data.{key}"
+        if key == "inventory" and isinstance(old, dict) and all(map(_safe_key, value.keys() | old.keys())):
+            for item in value.keys() | old.keys():
+                delta = value.get(item, 0) - old.get(item, 0)
+                if delta:
+                    incs[f"{path}.{item}"] = delta
+        elif key == "equipment" and isinstance(old, dict) and all(map(_safe_key, value.keys() | old.keys())):
+            for slot in value.keys() | old.keys():
+                if value.get(slot) != old.get(slot):
+                    sets[f"{path}.{slot}"] = value.get(slot)
+        elif (key == "log" and isinstance(old, list) and 0 < log_new <= len(value)
+              and (old + value[-log_new:])[-log_limit:] == value):
+            push[path] = {"$each": value[-log_new:], "$slice": -log_limit}
+        else:
+            sets[path] = value
+    update = {}
+    if sets:
+        update["$set"] = sets
+    if incs:
+        update["$inc"] = incs
+    if push:
+        update["$push"] = push
+    return update or None
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def rebase_state(base: dict, ours: dict, theirs: dict, log_new: int, log_limit: int) -> dict:
+    """Переносит наши изменения (base -> ours) на чужое состояние theirs.
+
+    Числа и количества предметов меняются на нашу дельту (ours - base),
+    предметов не бывает меньше нуля. Слоты экипировки и остальные поля
+    берутся нашими, только если мы их меняли. В лог дописываются наши
+    log_new новых строк.
+    """
+    merged = dict(theirs)
+    for key, value in ours.items():
+        old = base.get(key)
+        if value == old:
+            continue
+        current = theirs.get(key)
+        if _is_number(value) and _is_number(old) and _is_number(current):
+            merged[key] = current + value - old
+        elif key == "inventory" and isinstance(old, dict) and isinstance(current, dict):
+            items = dict(current)
+            for item in value.keys() | old.keys():
+                delta = value.get(item, 0) - old.get(item, 0)
+                if delta:
+                    items[item] = max(0, items.get(item, 0) + delta)
+            merged[key] = items
+        elif key == "equipment" and isinstance(old, dict) and isinstance(current, dict):
+            slots = dict(current)
+            for slot in value.keys() | old.keys():
+                if value.get(slot) != old.get(slot):
+                    slots[slot] = value.get(slot)
+            merged[key] = slots
+        elif key == "log" and isinstance(current, list) and 0 < log_new <= len(value):
+            merged[key] = (current + value[-log_new:])[-log_limit:]
+        else:
+            merged[key] = value
+    return merged
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ОТЛОЖЕННАЯ ЗАПИСЬ (WRITE-BEHIND)
+# ──────────────────────────────────────────────────────────────────────────────
+class WriteBehindSaver:
+    """Копит «грязные» игры и сбрасывает их пачками.
+
+    Повторные отметки одного uid схлопываются: в базу уходит только последнее
+    состояние. Сериализация происходит в момент сброса, а не в момент отметки.
+
+    tracker — объект с методами diff(game) -> (update | None, token),
+    version(game) -> версия документа, которую видела игра,
+    rebase(game, token, doc | None) -> (update | None, token) — те же
+    изменения поверх свежего документа из базы, commit(game, token, version)
+    после успешной записи и reset(game, token) после ошибки, когда
+    неизвестно, легла ли запись.
+
+    Если документ успел изменить другой воркер, документ перечитывается и
+    изменения переносятся на него заново (до cas_retries раз); commit после
+    такого переноса обновляет и игру в памяти.
+
+    after_write(items) — корутина, получает [(uid, update)] каждой записанной пачки.
+    """
+
+    def __init__(self, repo: PlayerRepository, tracker, max_delay: float = SAVE_MAX_DELAY,
+                 batch_size: int = SAVE_BATCH_SIZE, cas_retries: int = SAVE_CAS_RETRIES,
+                 after_write=None):
+        self.repo = repo
+        self.tracker = tracker
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.cas_retries = cas_retries
+        self.after_write = after_write
+        self._dirty = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.writes = 0
+        self.conflicts = 0
+
+    def mark_dirty(self, uid: int, game):
+        self._dirty[uid] = game
+        if len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self, uid: int):
+        return self._dirty.get(uid)
+
+    def pending_games(self):
+        return self._dirty.values()
+
+    def paused(self):
+        """Контекст, на время которого flush не пишет в базу."""
+        return self._flush_lock
+
+    def __len__(self):
+        return len(self._dirty)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # shield: отмена цикла при остановке не должна терять снятую пачку
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                logging.error(f"Ошибка отложенной записи: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            # Неудачные игры вернутся в очередь после сброса, а не крутятся в этом же цикле
+            requeue = {}
+            while self._dirty:
+                uids = list(islice(self._dirty, self.batch_size))
+                batch = [(uid, self._dirty.pop(uid)) for uid in uids]
+                ops, tokens = [], {}
+                for uid, game in batch:
+                    update, token = self.tracker.diff(game)
+                    if update:
+                        ops.append((uid, update, self.tracker.version(game)))
+                        tokens[uid] = (game, token)
+                if not ops:
+                    continue
+                started = time.perf_counter()
+                try:
+                    conflicts = await self.repo.update_many(ops)
+                    MONGO_SECONDS.observe(time.perf_counter() - started, "save")
+                    rebased, unresolved = await self._retry_conflicts(ops, conflicts, tokens)
+                except Exception as e:
+                    MONGO_SECONDS.observe(time.perf_counter() - started, "save_error")
+                    logging.error(f"Ошибка пакетного сохранения ({len(batch)} игр): {e}")
+                    # Часть операций могла примениться — повтор упрётся в версию, и
+                    # rebase по отметке reset поймёт, легла ли эта запись.
+                    # Возвращаем в очередь, не затирая более свежие отметки.
+                    for game, token in tokens.values():
+                        self.tracker.reset(game, token)
+                    for uid, game in batch:
+                        self._dirty.setdefault(uid, game)
+                    break
+                written = []
+                for uid, update, version in ops:
+                    game, token = tokens[uid]
+                    if uid in unresolved:
+                        requeue[uid] = game
+                        continue
+                    new_version = version + 1
+                    if uid in rebased:
+                        update, new_version = rebased[uid]
+                    self.writes += 1
+                    if update:
+                        written.append((uid, update))
+                    try:
+                        self.tracker.commit(game, token, new_version)
+                    except Exception as e:
+                        # Запись легла, но игра в памяти не обновилась — её версия
+                        # отстала, и следующий сброс перечитает документ
+                        logging.error(f"Не удалось зафиксировать сохранение игры {uid}: {e}")
+                        requeue[uid] = game
+                if written and self.after_write is not None:
+                    try:
+                        await self.after_write(written)
+                    except Exception as e:
+                        logging.error(f"Ошибка after_write ({len(written)} игр): {e}")
+            for uid, game in requeue.items():
+                self._dirty.setdefault(uid, game)
+
+    async def _retry_conflicts(self, ops: list, conflicts: list[int], tokens: dict):
+        """Переносит изменения конфликтующих игр на свежие документы и пишет снова.
+
+        tokens обновляются на месте. Возвращает ({uid: (записанный update или None,
+        новая версия)}, множество uid, которые так и не записались).
+        """
+        rebased = {}
+        for _ in range(self.cas_retries):
+            if not conflicts:
+                break
+            self.conflicts += len(conflicts)
+            docs = await self.repo.load_many(conflicts)
+            retry = []
+            for uid in conflicts:
+                game, token = tokens[uid]
+                doc = docs.get(uid)
+                version = doc.get("v", 0) if doc else 0
+                update, token = self.tracker.rebase(game, token, doc)
+                tokens[uid] = (game, token)
+                if update:
+                    retry.append((uid, update, version))
+                else:
+                    rebased[uid] = (None, version)  # в базе уже то, что мы хотели записать
+            conflicts = await self.repo.update_many(retry)
+            failed = set(conflicts)
+            for uid, update, version in retry:
+                if uid not in failed:
+                    rebased[uid] = (update, version + 1)
+        if conflicts:
+            logging.warning(f"Не удалось записать игры после {self.cas_retries} повторов: {conflicts}")
+        return rebased, set(conflicts)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._dirty:
+            logging.error(f"При остановке не сохранено игр: {len(self._dirty)}")
@@ -1,75 +1,138 @@
-from keyboards import get_main_kb, peek_kb, cat_kb, next_kb
+import json
+import os
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from keyboards import get_main_kb
+
+STORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "story.json")
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ФОРМАТ ИСТОРИЙ (data/story.json)
+# ──────────────────────────────────────────────────────────────────────────────
+# nodes:        id -> {"text": строка или список строк, "choices": [{"label", "callback"}]}
+# transitions:  callback -> {"requires": {...}, "effects": [...], "next": id узла или null}
+#
+# requires (все условия необязательны):
+#   {"story_state": [состояния], "items": {предмет: минимум}, "equipped": {слот: предмет}}
+# effects (применяются по порядку):
+#   {"log": текст}  {"karma": дельта}  {"inventory": {предмет: дельта}}  {"equip": {слот: предмет}}
+# next=null завершает историю и возвращает на главный экран.
+
+
+def _text(value) -> str:
+    return "\n".join(value) if isinstance(value, list) else str(value)
+
+
+def _compile_requires(spec: dict, where: str):
+    unknown = set(spec) - {"story_state", "items", "equipped"}
+    if unknown:
+        raise ValueError(f"{where}: неизвестные условия {sorted(unknown)}")
+    checks = []
+    if "story_state" in spec:
+        states = frozenset(spec["story_state"])
+        checks.append(lambda game: game.story_state in states)
+    for item, count in spec.get("items", {}).items():
+        checks.append(lambda game, item=item, count=count: game.inventory.get(item, 0) >= count)
+    for slot, item in spec.get("equipped", {}).items():
+        checks.append(lambda game, slot=slot, item=item: game.equipment.get(slot) == item)
+    return tuple(checks)
+
+
+def _compile_effect(effect: dict, where: str):
+    if len(effect) != 1:
+        raise ValueError(f"{where}: эффект должен содержать ровно один ключ: {effect}")
+    (kind, value), = effect.items()
+    if kind == "log":
+        text = _text(value)
+        return lambda game: game.add_log(text)
+    if kind == "karma":
+        return lambda game: setattr(game, "karma", game.karma + value)
+    if kind == "inventory":
+        deltas = tuple(value.items())
+
+        def apply(game):
+            for item, delta in deltas:
+                game.inventory[item] = max(0, game.inventory.get(item, 0) + delta)
+        return apply
+    if kind == "equip":
+        slots = tuple(value.items())
+
+        def apply(game):
+            for slot, item in slots:
+                game.equipment[slot] = item
+        return apply
+    raise ValueError(f"{where}: неизвестный эффект {kind!r}")
+
+
+class _Transition:
+    __slots__ = ("requires", "effects", "next", "text", "kb")
+
+    def __init__(self, requires, effects, next_node, text, kb):
+        self.requires = requires
+        self.effects = effects
+        self.next = next_node
+        self.text = text
+        self.kb = kb
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ДВИЖОК
+# ──────────────────────────────────────────────────────────────────────────────
+class StoryEngine:
+    """Граф историй, скомпилированный в таблицу переходов callback -> переход.
+
+    Тексты и клавиатуры узлов собираются один раз при загрузке, поэтому ход
+    по истории — это поиск в словаре и применение готовых эффектов.
+    """
+
+    def __init__(self, spec: dict):
+        nodes = {}
+        for node_id, node in spec.get("nodes", {}).items():
+            rows = [[InlineKeyboardButton(text=c["label"], callback_data=c["callback"])]
+                    for c in node.get("choices", ())]
+            nodes[node_id] = (_text(node["text"]), InlineKeyboardMarkup(inline_keyboard=rows) if rows else None)
+        self.transitions = {}
+        for callback, tr in spec.get("transitions", {}).items():
+            where = f"переход {callback!r}"
+            next_node = tr.get("next")
+            if next_node is not None and next_node not in nodes:
+                raise ValueError(f"{where}: нет узла {next_node!r}")
+            text, kb = nodes[next_node] if next_node is not None else (None, None)
+            self.transitions[callback] = _Transition(
+                _compile_requires(tr.get("requires", {}), where),
+                tuple(_compile_effect(e, where) for e in tr.get("effects", ())),
+                next_node, text, kb,
+            )
+        for node_id, node in spec.get("nodes", {}).items():
+            for choice in node.get("choices", ()):
+                if choice["callback"] not in self.transitions:
+                    raise ValueError(f"узел {node_id!r}: выбор {choice['callback']!r} никуда не ведёт")
+
+    @classmethod
+    def load(cls, path: str = STORY_PATH) -> "StoryEngine":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @property
+    def callbacks(self) -> tuple[str, ...]:
+        return tuple(self.transitions)
+
+    def advance(self, data: str, game):
+        tr = self.transitions.get(data)
+        if tr is None or not all(check(game) for check in tr.requires):
+            return None, None
+        for effect in tr.effects:
+            effect(game)
+        game.story_state = tr.next
+        if tr.next is None:
+            game.reset_nav()
+            return game.get_ui(), get_main_kb(game)
+        return tr.text, tr.kb
+
+
+ENGINE = StoryEngine.load()
+
 
 def handle_story(data, game, uid):
-    text = None
-    kb = None
-    if data == "wolf_flee":
-        game.add_log(
-            "Ты медленно пятишься назад, стараясь не хрустнуть ни одной веткой.\n"
-            "Через несколько шагов рычание стихает за деревьями.\n"
-            "Что бы там ни было под пнём — оно теперь не твоё дело.\n"
-            "Сердце всё ещё колотится."
-        )
-        game.story_state = None
-        game.reset_nav()
-        text = game.get_ui()
-        kb = get_main_kb(game)
-    elif data == "wolf_fight":
-        fight_text = (
-            "Ты поднимаешь факел повыше. Пламя трещит громче.\n"
-            "Волк резко оборачивается, глаза вспыхивают жёлтым в свете огня.\n"
-            "Секунду он смотрит на тебя — не нападает, но и не отступает.\n"
-            "Тогда ты делаешь шаг вперёд и рычишь сам — низко, зло, по-человечески неумело.\n"
-            "Факел вспыхивает ярче от рывка воздуха.\n"
-            "Зверь подается назад и ты замахиваешься факелом.\n"
-            "Ещё мгновение — и ты видишь как подпалённый волк убегает в темноту между деревьями, бросив свою яму.\n"
-            "Остатки факела медленно догорают на земле возле тебя.\n\n"
-            "Теперь перед тобой открытая яма под пнём."
-        )
-        game.equipment["hand"] = None
-        game.inventory["Факел"] = max(0, game.inventory.get("Факел", 0) - 1)
-        game.story_state = "after_fight"
-        text = fight_text
-        kb = peek_kb
-    elif data == "peek_den":
-        text = (
-            "Ты опускаешься на колени, наклоняешься ближе.\n"
-            "В слабом отсвете угасающих угольков факела, почти на самом дне ямы, блестят два огромных влажных глаза.\n"
-            "Они смотрят на тебя с ужасом и надеждой одновременно.\n"
-            "Маленький, грязный, дрожащий котёнок.\n"
-            "Шерсть слиплась от сырости, одно ухо надорвано.\n"
-            "Ты тихо протягиваешь руку.\n"
-            "Он долго не решается. Потом осторожно, очень медленно обнюхивает твои пальцы.\n"
-            "Ты чувствуешь холодный нос и слабое, прерывистое дыхание.\n\n"
-            "Твои действия:"
-        )
-        kb = cat_kb
-        game.story_state = "cat_choice"
-    elif data == "cat_leave":
-        game.add_log(
-            "Ты медленно убираешь руку.\n"
-            "Котёнок смотрит тебе вслед, но не мяукает.\n"
-            "Ты встаёшь, разворачиваешься и уходишь.\n"
-            "За спиной остаётся только тишина леса и ощущение, что ты только что прошёл мимо чего-то важного."
-        )
-        game.karma -= 50
-        game.story_state = None
-        game.reset_nav()
-        text = game.get_ui()
-        kb = get_main_kb(game)
-    elif data == "cat_take":
-        game.story_state = "cat_name_wait"
-        text = (
-            "Ты осторожно опускаешь обе ладони в яму.\n"
-            "Котёнок сначала отшатывается, потом сам делает маленький шаг навстречу.\n"
-            "Через секунду он уже у тебя на руках — лёгкий, холодный, дрожащий всем телом.\n"
-            "Ты прижимаешь его к груди, прикрывая полой куртки.\n\n"
-            "Как ты его назовёшь?"
-        )
-        kb = None
-    elif data == "story_next":
-        game.story_state = None
-        game.reset_nav()
-        text = game.get_ui()
-        kb = get_main_kb(game)
-    return text, kb
+    return ENGINE.advance(data, game)
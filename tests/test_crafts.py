@@ -0,0 +1,43 @@
+import random
+
+from crafts import CraftBook
+from game import Game
+
+ITEMS = ["Ветка", "Камень", "Спички ", "Верёвка", "Гриб"]
+
+BOOK = CraftBook([
+    {"id": "Факел", "ingredients": {"Ветка": 1, "Спички ": 1}},
+    {"id": "Топор", "ingredients": {"Ветка": 2, "Камень": 1, "Верёвка": 1}},
+    {"id": "Костёр", "ingredients": {"Ветка": 3, "Спички ": 1}},
+    {"id": "Суп", "ingredients": {"Гриб": 2}, "result": {"Суп": 1}},
+    {"id": "Праща", "ingredients": {"Верёвка": 1, "Камень": 2}},
+])
+
+
+def full_scan(game: Game) -> list[str]:
+    return [recipe.id for recipe in BOOK.ordered if recipe.can_craft(game.inventory)]
+
+
+def test_incremental_available_matches_full_scan():
+    rng = random.Random(12)
+    game = Game()
+    for step in range(3000):
+        roll = rng.random()
+        item = rng.choice(ITEMS)
+        if roll < 0.4:
+            game.inventory[item] += rng.randint(1, 3)
+        elif roll < 0.7:
+            game.inventory[item] = max(0, game.inventory.get(item, 0) - rng.randint(1, 3))
+        elif roll < 0.8:
+            if item in game.inventory:
+                del game.inventory[item]
+        elif roll < 0.9:
+            BOOK.craft(game, rng.choice(list(BOOK.recipes)))
+        elif roll < 0.95:
+            state = game.snapshot()
+            state["inventory"] = {name: rng.randint(0, 3) for name in ITEMS}
+            game.adopt(state)
+        else:
+            game = Game.decode(game.encode())
+        if rng.random() < 0.5:
+            assert [recipe.id for recipe in BOOK.available(game)] == full_scan(game), step
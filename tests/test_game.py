@@ -0,0 +1,43 @@
+import pytest
+
+from game import LOG_LIMIT, SCHEMA_VERSION, START_INVENTORY, Game
+
+
+def test_encode_decode_roundtrip():
+    game = Game()
+    game.day = 42
+    game.inventory["Ветка"] = 3
+    game.equipment["hand"] = "Факел"
+    game.add_log("строка")
+    assert Game.decode(game.encode()).encode() == game.encode()
+
+
+def test_old_schema_is_migrated():
+    data = Game().encode()
+    del data["schema"]
+    del data["nav_stack"]
+    game = Game.decode(data)
+    assert game.nav_stack == ["main"]
+    assert game.encode()["schema"] == SCHEMA_VERSION
+
+
+def test_newer_schema_is_rejected():
+    data = Game().encode()
+    data["schema"] = SCHEMA_VERSION + 1
+    with pytest.raises(ValueError):
+        Game.decode(data)
+
+
+def test_fields_of_wrong_type_fall_back_to_defaults():
+    data = Game().encode()
+    data.update(day="42", found_branch_once=1, hp=True, inventory=[], log=list(range(LOG_LIMIT + 5)))
+    game = Game.decode(data)
+    assert (game.day, game.found_branch_once, game.hp) == (1, False, 100)
+    assert dict(game.inventory) == START_INVENTORY
+    assert game.log == [str(i) for i in range(5, LOG_LIMIT + 5)]
+
+
+def test_missing_fields_get_defaults():
+    game = Game.decode({"schema": SCHEMA_VERSION, "day": 7})
+    assert game.day == 7
+    assert game.encode() == {**Game().encode(), "day": 7}
@@ -0,0 +1,107 @@
+import asyncio
+import copy
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from game import Game, LOG_LIMIT
+from journal import JournalRepository, apply_ops, encode_update
+from storage import build_delta
+
+
+def saved(game: Game) -> dict:
+    """Сохраняет игру так же, как это делает GameChanges.commit."""
+    state = game.snapshot()
+    game._saved = state
+    game._log_new = 0
+    return copy.deepcopy(state)
+
+
+def replay(stored: dict, game: Game) -> dict:
+    update = build_delta(game._saved, game.snapshot(), game._log_new, LOG_LIMIT)
+    return apply_ops({"game_data": stored}, encode_update(update))["game_data"]
+
+
+def test_scalars_and_equipment_replay():
+    game = Game()
+    stored = saved(game)
+    game.hp = 80
+    game.story_state = "wolf"
+    game.equipment["hand"] = "Факел"
+    assert replay(stored, game) == game.encode()
+
+
+def test_inc_on_missing_inventory_key():
+    game = Game()
+    stored = saved(game)
+    game.inventory["Ветка"] += 2
+    game.inventory["Сухпай"] -= 1
+    assert "Ветка" not in stored["inventory"]
+    assert replay(stored, game) == game.encode()
+
+
+def test_push_with_negative_slice_after_log_trim():
+    game = Game()
+    for i in range(LOG_LIMIT):
+        game.add_log(f"старое {i}")
+    stored = saved(game)
+    for i in range(5):
+        game.add_log(f"новое {i}")
+    update = build_delta(game._saved, game.snapshot(), game._log_new, LOG_LIMIT)
+    assert update["$push"]["game_data.log"]["$slice"] == -LOG_LIMIT
+    result = replay(stored, game)
+    assert result == game.encode()
+    assert result["log"][-1] == "новое 4"
+
+
+def test_more_new_lines_than_log_limit():
+    game = Game()
+    stored = saved(game)
+    for i in range(LOG_LIMIT + 3):
+        game.add_log(f"строка {i}")
+    assert replay(stored, game) == game.encode()
+
+
+def test_chain_of_saves_replays_to_current_state():
+    game = Game()
+    stored = saved(game)
+    for step in range(30):
+        game.ap = step % 6
+        game.inventory[f"Предмет {step % 4}"] += 1
+        game.add_log(f"ход {step}")
+        stored = replay(stored, game)
+        assert stored == game.encode()
+        saved(game)
+
+
+class FailingEvents:
+    """player_events, вставка в которую падает с заданной ошибкой."""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    async def insert_many(self, docs, ordered=True):
+        raise self.error
+
+
+def journal_with(error: Exception) -> JournalRepository:
+    repo = JournalRepository("mongodb://localhost:1")
+    repo.events = FailingEvents(error)
+    for uid in (1, 2):
+        repo.note_action(uid, f"action_{uid}")
+    return repo
+
+
+def test_actions_survive_a_failed_insert():
+    repo = journal_with(ConnectionError("нет соединения"))
+    with pytest.raises(ConnectionError):
+        asyncio.run(repo.update_many([(1, {"$set": {"game_data.ap": 4}}, 0), (2, {"$set": {"game_data.ap": 3}}, 5)]))
+    assert repo._actions == {1: ["action_1"], 2: ["action_2"]}
+
+
+def test_actions_of_failed_events_survive_a_partial_insert():
+    error = BulkWriteError({"writeErrors": [{"index": 1, "code": 2, "errmsg": "bad value"}]})
+    repo = journal_with(error)
+    with pytest.raises(BulkWriteError):
+        asyncio.run(repo.update_many([(1, {"$set": {"game_data.ap": 4}}, 0), (2, {"$set": {"game_data.ap": 3}}, 5)]))
+    assert repo._actions == {2: ["action_2"]}  # событие игрока 1 легло вместе со своими действиями
@@ -0,0 +1,223 @@
+import asyncio
+import copy
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("TOKEN", "123456:test")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:1")
+os.environ.setdefault("STATE_BACKEND", "memory")
+
+import main  # noqa: E402
+from actions import EXPLORE_FINDS  # noqa: E402
+from game import Game  # noqa: E402
+from journal import apply_ops, encode_update  # noqa: E402
+from storage import PlayerRepository, WriteBehindSaver  # noqa: E402
+
+
+class MemoryRepository(PlayerRepository):
+    """Документы в словаре; update-документы применяются как в MongoDB."""
+
+    def __init__(self):
+        self.docs = {}
+        self.fail_after_write = False
+
+    async def load(self, uid: int) -> dict | None:
+        return copy.deepcopy(self.docs.get(uid))
+
+    async def update(self, uid: int, update: dict, version: int) -> bool:
+        doc = self.docs.setdefault(uid, {"_id": uid})
+        if doc.get("v", 0) != version:
+            return False
+        apply_ops(doc, encode_update(copy.deepcopy(update)))
+        doc["v"] = version + 1
+        if self.fail_after_write:
+            self.fail_after_write = False
+            raise ConnectionError("ответ потерян")
+        return True
+
+    async def versions(self, uids: list[int]) -> dict[int, int]:
+        return {uid: self.docs[uid].get("v", 0) for uid in uids if uid in self.docs}
+
+
+def press(game: Game, data: str):
+    main.router.resolve(data)(data, game, 1)
+
+
+def saver_for(repo) -> WriteBehindSaver:
+    return WriteBehindSaver(repo, main.GameChanges)
+
+
+async def saved_game(repo, uid: int = 1) -> Game:
+    """Игра, как её поднимет воркер из базы."""
+    return main.game_from_document(await repo.load(uid))
+
+
+def test_two_workers_exploring_from_the_same_version_both_count():
+    async def scenario():
+        repo = MemoryRepository()
+        first = Game()
+        saver = saver_for(repo)
+        saver.mark_dirty(1, first)
+        await saver.flush()
+        a, b = await saved_game(repo), await saved_game(repo)
+        press(a, "action_1")
+        press(b, "action_1")
+        saver_a, saver_b = saver_for(repo), saver_for(repo)
+        saver_a.mark_dirty(1, a)
+        await saver_a.flush()
+        saver_b.mark_dirty(1, b)
+        await saver_b.flush()
+        assert saver_b.conflicts == 1
+        data = repo.docs[1]["game_data"]
+        assert data["ap"] == 3
+        assert sum(data["inventory"].get(item, 0) for item in EXPLORE_FINDS) == 2
+        assert data["log"][-2:] == [a.log[-1], b.log[-1]]
+        # Игра в памяти второго воркера догнала базу и дальше пишет от неё
+        assert b._version == repo.docs[1]["v"] and b.ap == 3
+        assert b.snapshot() == data
+
+    asyncio.run(scenario())
+
+
+def test_missed_world_tick_is_not_overwritten():
+    async def scenario():
+        repo = MemoryRepository()
+        saver = saver_for(repo)
+        saver.mark_dirty(1, Game())
+        await saver.flush()
+        game = await saved_game(repo)
+        # Тик мира на другом воркере: сытость и вода падают в базе
+        repo.docs[1]["game_data"]["hunger"] -= 5
+        repo.docs[1]["game_data"]["thirst"] -= 8
+        repo.docs[1]["v"] += 1
+        press(game, "action_3")  # глоток: вода +30
+        saver.mark_dirty(1, game)
+        await saver.flush()
+        data = repo.docs[1]["game_data"]
+        assert data["hunger"] == 15
+        assert data["thirst"] == 60 - 8 + 30
+
+    asyncio.run(scenario())
+
+
+def test_new_game_overwrites_the_document():
+    async def scenario():
+        repo = MemoryRepository()
+        saver = saver_for(repo)
+        old = Game()
+        press(old, "action_1")
+        saver.mark_dirty(1, old)
+        await saver.flush()
+        fresh = Game()  # «Новая игра» на воркере, который документа не видел
+        saver.mark_dirty(1, fresh)
+        await saver.flush()
+        assert repo.docs[1]["game_data"] == Game().snapshot()
+
+    asyncio.run(scenario())
+
+
+def test_write_that_landed_before_an_error_is_not_applied_twice():
+    async def scenario():
+        repo = MemoryRepository()
+        saver = saver_for(repo)
+        saver.mark_dirty(1, Game())
+        await saver.flush()
+        game = await saved_game(repo)
+        press(game, "action_1")
+        repo.fail_after_write = True
+        saver.mark_dirty(1, game)
+        await saver.flush()  # запись легла, но ответ потерян
+        press(game, "action_1")
+        await saver.flush()
+        data = repo.docs[1]["game_data"]
+        assert data["ap"] == 3
+        assert data == game.snapshot()
+
+    asyncio.run(scenario())
+
+
+def test_failed_commit_requeues_the_game_and_keeps_the_saver_running():
+    async def scenario():
+        repo = MemoryRepository()
+        saver = saver_for(repo)
+        saver.mark_dirty(1, Game())
+        await saver.flush()
+        game = await saved_game(repo)
+        # Другой воркер уже пишет схему новее нашей: adopt после переноса упадёт
+        repo.docs[1]["game_data"]["schema"] += 1
+        repo.docs[1]["v"] += 1
+        press(game, "action_1")
+        saver.max_delay = 0.01
+        saver.start()
+        saver.mark_dirty(1, game)
+        await asyncio.sleep(0.05)
+        assert saver.pending(1) is game
+        saver.mark_dirty(2, Game())
+        await asyncio.sleep(0.05)
+        assert repo.docs[2]["game_data"] == Game().snapshot()
+        await saver.stop()
+
+    asyncio.run(scenario())
+
+
+def test_unreadable_save_is_not_replaced_by_a_new_game(monkeypatch):
+    async def scenario():
+        repo = MemoryRepository()
+        game = Game()
+        game.day = 42
+        repo.docs[1] = {"_id": 1, "v": 3, "game_data": {**game.snapshot(), "schema": game.snapshot()["schema"] + 1}}
+        monkeypatch.setattr(main, "repo", repo)
+        with pytest.raises(main.GameLoadError):
+            await main.load_game(1)
+        assert repo.docs[1]["game_data"]["day"] == 42
+
+    asyncio.run(scenario())
+
+
+def test_missing_save_loads_as_none(monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(main, "repo", MemoryRepository())
+        assert await main.load_game(1) is None
+
+    asyncio.run(scenario())
+
+
+def test_continue_over_unreadable_save_asks_to_retry(monkeypatch):
+    async def scenario():
+        repo = MemoryRepository()
+        data = {**Game().snapshot(), "day": 42}
+        data["schema"] += 1
+        repo.docs[1] = {"_id": 1, "v": 3, "game_data": data}
+        monkeypatch.setattr(main, "repo", repo)
+        answers = []
+
+        async def answer(text=None, **kwargs):
+            answers.append(text)
+
+        callback = SimpleNamespace(message=SimpleNamespace(chat=SimpleNamespace(id=1)), answer=answer)
+        await main.handle_callback(callback, 1, "load_game", None)
+        assert answers == [main.LOAD_ERROR_TEXT]
+        assert main.saver.pending(1) is None and main.games.get(1) is None
+        assert repo.docs[1]["game_data"]["day"] == 42
+
+    asyncio.run(scenario())
+
+
+def test_startup_retry_without_limit_waits_for_the_database(monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(main, "STARTUP_RETRY_DELAY", 0)
+        calls = []
+
+        async def ping():
+            calls.append(1)
+            if len(calls) <= main.STARTUP_RETRIES * 2:
+                raise ConnectionError("нет соединения")
+            return True
+
+        with pytest.raises(ConnectionError):
+            await main.with_retry("MongoDB", ping)
+        assert await main.with_retry("MongoDB", ping, attempts=None)
+
+    asyncio.run(scenario())
@@ -0,0 +1,127 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from sender import OutboundDispatcher
+
+
+class FakeBot:
+    """Записывает вызовы Bot API; gate задерживает ответ, errors — очередь исключений."""
+
+    def __init__(self):
+        self.calls = []
+        self.errors = []
+        self.gate = None
+
+    async def _call(self, kwargs: dict):
+        self.calls.append(kwargs)
+        if self.gate is not None:
+            await self.gate.wait()
+        await asyncio.sleep(0.001)
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(**{"message_id": len(self.calls), **kwargs})
+
+    async def send_message(self, **kwargs):
+        return await self._call(kwargs)
+
+    async def edit_message_text(self, **kwargs):
+        return await self._call(kwargs)
+
+
+def flood() -> TelegramRetryAfter:
+    return TelegramRetryAfter(method=SimpleNamespace(), message="Too Many Requests", retry_after=0)
+
+
+def make_dispatcher(bot: FakeBot, **kwargs) -> OutboundDispatcher:
+    options = dict(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000)
+    options.update(kwargs)
+    return OutboundDispatcher(bot, **options)
+
+
+def test_queued_edits_of_one_message_are_coalesced():
+    async def scenario():
+        bot = FakeBot()
+        outbox = make_dispatcher(bot)
+        edits = [asyncio.create_task(outbox.edit_message_text(f"v{i}", chat_id=1, message_id=7)) for i in range(3)]
+        await asyncio.sleep(0)
+        outbox.start()
+        results = await asyncio.gather(*edits)
+        assert [call["text"] for call in bot.calls] == ["v2"]
+        assert results[0] is results[1] is results[2]
+        assert outbox.coalesced == 2
+        await outbox.stop()
+
+    asyncio.run(scenario())
+
+
+def test_requests_of_one_chat_keep_their_order():
+    async def scenario():
+        bot = FakeBot()
+        outbox = make_dispatcher(bot, concurrency=8)
+        outbox.start()
+        sends = [outbox.send_message(chat_id, f"{chat_id}:{i}") for i in range(5) for chat_id in (1, 2)]
+        await asyncio.gather(*sends)
+        for chat_id in (1, 2):
+            texts = [call["text"] for call in bot.calls if call["chat_id"] == chat_id]
+            assert texts == [f"{chat_id}:{i}" for i in range(5)]
+        await outbox.stop()
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_pauses_and_requeues_at_the_head_of_the_chat():
+    async def scenario():
+        bot = FakeBot()
+        bot.errors.append(flood())
+        outbox = make_dispatcher(bot)
+        outbox.start()
+        first, second = await asyncio.gather(outbox.send_message(1, "a"), outbox.send_message(1, "b"))
+        assert [call["text"] for call in bot.calls] == ["a", "a", "b"]
+        assert (first.text, second.text) == ("a", "b")
+        assert outbox.retry_after == 1
+        await outbox.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failed_edit_takes_the_result_of_a_newer_edit():
+    async def scenario():
+        bot = FakeBot()
+        bot.gate = asyncio.Event()
+        bot.errors.append(flood())
+        outbox = make_dispatcher(bot)
+        outbox.start()
+        old = asyncio.create_task(outbox.edit_message_text("old", chat_id=1, message_id=7))
+        await asyncio.sleep(0.01)  # старая правка уже ушла и ждёт ответа
+        new = asyncio.create_task(outbox.edit_message_text("new", chat_id=1, message_id=7))
+        await asyncio.sleep(0)
+        bot.gate.set()
+        old_result, new_result = await asyncio.gather(old, new)
+        assert [call["text"] for call in bot.calls] == ["old", "new"]
+        assert old_result is new_result
+        await outbox.stop()
+
+    asyncio.run(scenario())
+
+
+def test_request_waiting_for_a_slot_respects_a_new_pause():
+    async def scenario():
+        bot = FakeBot()
+        bot.gate = asyncio.Event()
+        bot.errors.append(flood())
+        outbox = make_dispatcher(bot, concurrency=1)
+        outbox.start()
+        first = asyncio.create_task(outbox.send_message(1, "a"))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(outbox.send_message(2, "b"))
+        await asyncio.sleep(0.01)  # второй чат ждёт единственный слот
+        bot.gate.set()
+        await asyncio.sleep(0.1)
+        assert [call["text"] for call in bot.calls] == ["a"]  # пауза ещё идёт
+        await asyncio.gather(first, second)
+        assert sorted(call["text"] for call in bot.calls[1:]) == ["a", "b"]
+        await outbox.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,34 @@
+import asyncio
+import tracemalloc
+
+from state import MemoryStateBackend
+
+
+def test_memory_backend_does_not_grow_with_claims():
+    async def scenario():
+        backend = MemoryStateBackend()
+        assert await backend.claim_session(0, "w") == "w"
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for uid in range(20000):
+            assert await backend.claim_session(uid, "w") == "w"
+        grown = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        assert grown < 10000
+
+    asyncio.run(scenario())
+
+
+def test_memory_backend_sweeps_inactive_players_and_chats():
+    async def scenario():
+        backend = MemoryStateBackend(ttl=60)
+        await backend.set_screen(1, 10, 123)
+        await backend.track_message(100, 10, limit=5)
+        assert await backend.get_screen(1) == {"msg": 10, "fp": 123}
+        expires = max(backend.screens[1][1], backend.tracked[100][1])
+        assert backend.sweep(now=expires - 61) == 0
+        assert backend.sweep(now=expires) == 2
+        assert await backend.get_screen(1) is None
+        assert await backend.pop_tracked(100) == []
+
+    asyncio.run(scenario())
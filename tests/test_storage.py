@@ -0,0 +1,87 @@
+from storage import build_delta, rebase_state
+
+LOG_LIMIT = 3
+
+
+def state(**changes) -> dict:
+    data = {
+        "hp": 100,
+        "ap": 5,
+        "inventory": {"Ветка": 1, "Камень": 2},
+        "equipment": {"hand": None, "head": None},
+        "log": ["a", "b"],
+    }
+    data.update(changes)
+    return data
+
+
+def test_nothing_changed():
+    assert build_delta(state(), state(), 0, LOG_LIMIT) is None
+
+
+def test_unknown_saved_state_rewrites_game_data():
+    assert build_delta(None, state(), 0, LOG_LIMIT) == {"$set": {"game_data": state()}}
+
+
+def test_scalars_are_set():
+    assert build_delta(state(), state(ap=4, hp=90), 0, LOG_LIMIT) == {
+        "$set": {"game_data.ap": 4, "game_data.hp": 90},
+    }
+
+
+def test_inventory_added_and_removed_items_are_incremented():
+    saved = state(inventory={"Ветка": 1, "Камень": 2})
+    current = state(inventory={"Камень": 2, "Гриб": 3})
+    assert build_delta(saved, current, 0, LOG_LIMIT) == {
+        "$inc": {"game_data.inventory.Ветка": -1, "game_data.inventory.Гриб": 3},
+    }
+
+
+def test_inventory_unsafe_key_falls_back_to_whole_field():
+    for key in ("a.b", "$where"):
+        current = state(inventory={"Ветка": 1, "Камень": 2, key: 1})
+        assert build_delta(state(), current, 0, LOG_LIMIT) == {
+            "$set": {"game_data.inventory": current["inventory"]},
+        }
+
+
+def test_equipment_slots_are_set_separately():
+    current = state(equipment={"hand": "Факел", "head": None})
+    assert build_delta(state(), current, 0, LOG_LIMIT) == {"$set": {"game_data.equipment.hand": "Факел"}}
+
+
+def test_equipment_unsafe_slot_falls_back_to_whole_field():
+    current = state(equipment={"hand": None, "head": None, "$x": "y"})
+    assert build_delta(state(), current, 0, LOG_LIMIT) == {"$set": {"game_data.equipment": current["equipment"]}}
+
+
+def test_log_is_pushed_and_sliced_after_trim():
+    saved = state(log=["a", "b", "c"])
+    current = state(log=["c", "d", "e"])  # старые строки уже обрезаны до LOG_LIMIT
+    assert build_delta(saved, current, 2, LOG_LIMIT) == {
+        "$push": {"game_data.log": {"$each": ["d", "e"], "$slice": -LOG_LIMIT}},
+    }
+
+
+def test_log_with_unknown_new_lines_is_set():
+    current = state(log=["x", "y"])
+    assert build_delta(state(), current, 0, LOG_LIMIT) == {"$set": {"game_data.log": ["x", "y"]}}
+
+
+def test_rebase_applies_our_changes_on_top_of_theirs():
+    base = state()
+    ours = state(ap=4, inventory={"Ветка": 2, "Камень": 2}, equipment={"hand": "Факел", "head": None},
+                 log=["a", "b", "мы"])
+    theirs = state(ap=4, hp=80, inventory={"Ветка": 1, "Камень": 0}, equipment={"hand": None, "head": "Шапка"},
+                   log=["a", "b", "они"])
+    assert rebase_state(base, ours, theirs, 1, LOG_LIMIT) == state(
+        ap=3, hp=80,
+        inventory={"Ветка": 2, "Камень": 0},
+        equipment={"hand": "Факел", "head": "Шапка"},
+        log=["b", "они", "мы"],
+    )
+
+
+def test_rebase_keeps_their_fields_we_did_not_touch():
+    theirs = state(hp=50, log=["x"])
+    assert rebase_state(state(), state(), theirs, 0, LOG_LIMIT) == theirs
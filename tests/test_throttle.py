@@ -0,0 +1,62 @@
+import asyncio
+
+from state import MemoryStateBackend
+from throttle import DEFAULT_COST, NAV_COST, ActionThrottle, GcraTable
+
+RATE = 1.5
+BURST = 5
+
+
+def taps(table: GcraTable, cost: float, now: float = 0.0) -> int:
+    allowed = 0
+    while table.take("u", cost, RATE, BURST, now=now):
+        allowed += 1
+    return allowed
+
+
+def test_burst_is_allowed_then_throttled():
+    table = GcraTable()
+    assert taps(table, DEFAULT_COST) == BURST
+    assert not table.take("u", DEFAULT_COST, RATE, BURST, now=0.0)
+    # Через 1/rate секунд набегает ровно один токен
+    assert table.take("u", DEFAULT_COST, RATE, BURST, now=1 / RATE)
+    assert not table.take("u", DEFAULT_COST, RATE, BURST, now=1 / RATE)
+
+
+def test_navigation_gets_four_times_as_many_taps():
+    assert NAV_COST == DEFAULT_COST / 4
+    assert taps(GcraTable(), NAV_COST) == 4 * taps(GcraTable(), DEFAULT_COST)
+
+
+def test_keys_are_independent():
+    table = GcraTable()
+    taps(table, DEFAULT_COST)
+    assert table.take("other", DEFAULT_COST, RATE, BURST, now=0.0)
+
+
+def test_sweep_removes_only_full_buckets():
+    table = GcraTable(sweep_interval=1000)
+    table.take("a", DEFAULT_COST, RATE, BURST, now=0.0)  # tat = 1/rate
+    table.take("b", DEFAULT_COST, RATE, BURST, now=0.0)
+    table.take("b", DEFAULT_COST, RATE, BURST, now=0.0)  # tat = 2/rate
+    assert table.sweep(now=1 / RATE) == 1  # у "a" tat <= now — ведро снова полное
+    assert len(table) == 1
+    assert table.sweep(now=1.5 / RATE) == 0
+    assert table.sweep(now=2 / RATE) == 1
+    assert len(table) == 0
+
+
+def test_throttled_actions_are_counted_with_a_bounded_set_of_keys():
+    async def scenario():
+        throttle = ActionThrottle(MemoryStateBackend(), rate=0.001, burst=BURST)
+        while await throttle.allow(1, "junk_0"):
+            pass
+        for i in range(300):
+            assert not await throttle.allow(1, f"junk_{i}")
+        assert not await throttle.allow(1, "junk_0")
+        assert len(throttle.throttled_by_action) == 257
+        assert throttle.throttled_by_action["junk_0"] == 3
+        assert throttle.throttled_by_action["other"] == 300 - 256
+        assert throttle.throttled == sum(throttle.throttled_by_action.values())
+
+    asyncio.run(scenario())
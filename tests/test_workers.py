@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+from workers import UpdateWorkerPool
+
+
+def make_update(update_id: int, uid: int):
+    return SimpleNamespace(update_id=update_id, event=SimpleNamespace(from_user=SimpleNamespace(id=uid)))
+
+
+def test_one_player_in_order_and_slow_player_does_not_block_others():
+    async def scenario():
+        handled = []
+        release_slow = asyncio.Event()
+
+        async def handler(update):
+            uid = update.event.from_user.id
+            if uid == 1:
+                await release_slow.wait()  # как ожидание токена чата в Bot API
+            handled.append((uid, update.update_id))
+
+        pool = UpdateWorkerPool(handler, concurrency=4)
+        pool.start()
+        for i in range(8):
+            assert await pool.submit(make_update(i, 1))
+        assert await pool.submit(make_update(100, 9))
+        await asyncio.sleep(0.01)
+        assert handled == [(9, 100)]  # игрок 9 не ждёт медленного игрока 1
+        release_slow.set()
+        await pool.stop(timeout=1)
+        assert handled[1:] == [(1, i) for i in range(8)]
+        assert pool.processed == 9 and pool.depth() == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects_after_timeout():
+    async def scenario():
+        blocked = asyncio.Event()
+
+        async def handler(update):
+            await blocked.wait()
+
+        pool = UpdateWorkerPool(handler, queue_size=2, enqueue_timeout=0.01)
+        pool.start()
+        assert await pool.submit(make_update(1, 1))
+        assert await pool.submit(make_update(2, 2))
+        assert not await pool.submit(make_update(3, 3))
+        assert pool.rejected == 1
+        blocked.set()
+        await pool.stop(timeout=1)
+        assert pool.processed == 2
+
+    asyncio.run(scenario())
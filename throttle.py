@@ -0,0 +1,91 @@
+import os
+import time
+from collections import Counter
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1.5"))  # токенов в секунду
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))  # ёмкость ведра
+THROTTLE_SWEEP_INTERVAL = float(os.getenv("THROTTLE_SWEEP_INTERVAL", "30"))
+
+# Цена нажатия в токенах: навигация почти бесплатна, исследование — дороже
+DEFAULT_COST = 1.0
+NAV_COST = 0.25
+ACTION_COSTS = {
+    "action_1": 2.0,
+    "action_2": NAV_COST,
+    "inv_character": NAV_COST,
+    "inv_craft": NAV_COST,
+    "inv_use": NAV_COST,
+    "inv_inspect": NAV_COST,
+    "inv_drop": NAV_COST,
+    "back": NAV_COST,
+    "dummy": NAV_COST,
+}
+
+
+def action_cost(data: str) -> float:
+    return ACTION_COSTS.get(data, DEFAULT_COST)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# GCRA: TOKEN BUCKET В ОДНОМ ЧИСЛЕ НА ИГРОКА
+# ──────────────────────────────────────────────────────────────────────────────
+class GcraTable:
+    """Token bucket в форме GCRA: на ключ хранится одно «теоретическое время
+    прихода» (tat). tat <= now означает полное ведро — такую запись можно
+    удалить без потери информации, поэтому таблица содержит только тех,
+    кто нажимал в последние burst / rate секунд.
+    """
+
+    def __init__(self, sweep_interval: float = THROTTLE_SWEEP_INTERVAL):
+        self._tat = {}
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+
+    def __len__(self):
+        return len(self._tat)
+
+    def take(self, key, cost: float, rate: float, burst: float, now: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        if now >= self._next_sweep:
+            self.sweep(now)
+        tat = max(self._tat.get(key, now), now) + cost / rate
+        if tat - now > burst / rate:
+            return False
+        self._tat[key] = tat
+        return True
+
+    def sweep(self, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        expired = [key for key, tat in self._tat.items() if tat <= now]
+        for key in expired:
+            del self._tat[key]
+        self._next_sweep = now + self.sweep_interval
+        return len(expired)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# АНТИСПАМ ДЛЯ CALLBACK'ОВ
+# ──────────────────────────────────────────────────────────────────────────────
+class ActionThrottle:
+    """Списывает с ведра игрока цену действия; само ведро живёт в StateBackend."""
+
+    def __init__(self, backend, rate: float = THROTTLE_RATE, burst: float = THROTTLE_BURST):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.allowed = 0
+        self.throttled = 0
+        self.throttled_by_action = Counter()
+
+    async def allow(self, uid: int, data: str) -> bool:
+        if await self.backend.take(uid, action_cost(data), self.rate, self.burst):
+            self.allowed += 1
+            return True
+        self.throttled += 1
+        # callback_data приходит от клиента — не даём счётчику расти без предела
+        key = data if data in self.throttled_by_action or len(self.throttled_by_action) < 256 else "other"
+        self.throttled_by_action[key] += 1
+        return False
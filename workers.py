@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+from aiogram.types import Update
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+# Сколько апдейтов обрабатывается одновременно (разных игроков; один игрок — строго по одному)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "256"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "4000"))  # апдейтов в ожидании, всего
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", "1.0"))
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "15"))
+
+
+def update_user_id(update: Update) -> int:
+    try:
+        user = getattr(update.event, "from_user", None)
+    except Exception:
+        return 0
+    return user.id if user else 0
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ПУЛ ОБРАБОТЧИКОВ АПДЕЙТОВ
+# ──────────────────────────────────────────────────────────────────────────────
+class UpdateWorkerPool:
+    """Фоновая обработка апдейтов с очередью на каждого игрока.
+
+    Апдейты одного игрока складываются в его почтовый ящик и обрабатываются
+    строго по порядку одной задачей; разные игроки обрабатываются
+    параллельно, но не больше concurrency сразу. Медленный чат (ожидание
+    токена Bot API, сеть) задерживает только своего игрока.
+
+    Ожидающих апдейтов не больше queue_size: если места нет дольше
+    enqueue_timeout, submit() возвращает False и вебхук отвечает ошибкой —
+    Telegram доставит апдейт повторно.
+    """
+
+    def __init__(self, handler, concurrency: int = UPDATE_CONCURRENCY, queue_size: int = UPDATE_QUEUE_SIZE,
+                 enqueue_timeout: float = UPDATE_ENQUEUE_TIMEOUT):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self._mailboxes = {}  # uid -> deque апдейтов, пока у игрока есть работа
+        self._tasks = set()  # задачи, разбирающие ящики: держим ссылки, чтобы их не собрал GC
+        self._slots = None
+        self._space = None  # выставлен, пока есть место для новых апдейтов
+        self._idle = None  # выставлен, пока ничего не ждёт и не выполняется
+        self._pending = 0
+        self._started = False
+        self._closed = False
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._closed = False
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._space = asyncio.Event()
+        self._space.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def submit(self, update: Update) -> bool:
+        if self._closed or not self._started:
+            self.rejected += 1
+            return False
+        if self._pending >= self.queue_size:
+            try:
+                while self._pending >= self.queue_size:
+                    self._space.clear()
+                    await asyncio.wait_for(self._space.wait(), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                logging.warning(f"Очередь апдейтов переполнена, апдейт {update.update_id} отклонён")
+                return False
+        self._pending += 1
+        self._idle.clear()
+        uid = update_user_id(update)
+        mailbox = self._mailboxes.get(uid)
+        if mailbox is not None:
+            mailbox.append(update)  # ящик уже разбирается — апдейт дождётся своей очереди
+            return True
+        self._mailboxes[uid] = deque((update,))
+        task = asyncio.create_task(self._drain(uid))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    def depth(self) -> int:
+        return self._pending
+
+    async def _drain(self, uid: int):
+        mailbox = self._mailboxes[uid]
+        try:
+            while mailbox:
+                update = mailbox.popleft()
+                try:
+                    async with self._slots:
+                        await self.handler(update)
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logging.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+                finally:
+                    self._done()
+        finally:
+            del self._mailboxes[uid]
+
+    def _done(self):
+        self._pending -= 1
+        if self._pending < self.queue_size:
+            self._space.set()
+        if not self._pending:
+            self._idle.set()
+
+    async def stop(self, timeout: float = UPDATE_DRAIN_TIMEOUT):
+        if not self._started:
+            return
+        self._closed = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Не успели обработать апдейтов при остановке: {self.depth()}")
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._mailboxes.clear()
+        self._pending = 0
+        self._started = False
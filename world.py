@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from game import SCALAR_FIELDS
+from metrics import MONGO_SECONDS
+
+# ──────────────────────────────────────────────────────────────────────────────
+# НАСТРОЙКИ
+# ──────────────────────────────────────────────────────────────────────────────
+WORLD_TICK_INTERVAL = float(os.getenv("WORLD_TICK_INTERVAL", "3600"))  # 0 — мир стоит на месте
+WORLD_HUNGER_DECAY = int(os.getenv("WORLD_HUNGER_DECAY", "5"))  # сытость за тик
+WORLD_THIRST_DECAY = int(os.getenv("WORLD_THIRST_DECAY", "8"))  # вода за тик
+
+# Погода меняется цепью Маркова: текущая -> ((следующая, вес), ...)
+WEATHER_TRANSITIONS = {
+    "clear": (("clear", 6), ("cloudy", 3), ("rain", 1)),
+    "cloudy": (("clear", 3), ("cloudy", 3), ("rain", 4)),
+    "rain": (("clear", 2), ("cloudy", 4), ("rain", 4)),
+}
+
+
+def next_weather(current: str | None, rng=random) -> str:
+    options = WEATHER_TRANSITIONS.get(current, WEATHER_TRANSITIONS["clear"])
+    return rng.choices([w for w, _ in options], weights=[n for _, n in options])[0]
+
+
+def decayed(value: int, by: int) -> int:
+    return max(0, value - by)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ТИК МИРА
+# ──────────────────────────────────────────────────────────────────────────────
+class WorldClock:
+    """Периодически двигает мир для всех игроков одним update_many на сервере.
+
+    Тик получает номер из документа world.clock; право на тик — как аренда:
+    его берёт тот воркер, чей find_one_and_update первым застал next_at в
+    прошлом. Документы игроков меняются конвейером обновления (погода,
+    сытость, вода, v + 1), а номер тика пишется в game_data.world_tick —
+    поэтому один тик никогда не применяется к игроку дважды.
+
+    Игры в памяти этого воркера получают те же изменения и в состоянии, и в
+    сохранённом срезе (_saved), так что дельты не затирают работу тика.
+    Остальные воркеры узнают о тике через конфликт версий при записи.
+
+    local_games() — игры в памяти; pause_saves() — контекст, на время
+    которого отложенная запись не пишет в базу.
+    """
+
+    def __init__(self, db, local_games, pause_saves, interval: float = WORLD_TICK_INTERVAL,
+                 hunger_decay: int = WORLD_HUNGER_DECAY, thirst_decay: int = WORLD_THIRST_DECAY):
+        self.players = db["players"]
+        self.world = db["world"]
+        self.local_games = local_games
+        self.pause_saves = pause_saves
+        self.interval = interval
+        self.hunger_decay = hunger_decay
+        self.thirst_decay = thirst_decay
+        self._task = None
+        self.ticks = 0
+
+    async def _claim(self) -> tuple[int, str] | None:
+        now = time.time()
+        try:
+            doc = await self.world.find_one_and_update(
+                {"_id": "clock", "next_at": {"$lte": now}},
+                {"$set": {"next_at": now + self.interval}, "$inc": {"tick": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return None  # тик ещё не пора или его уже взял другой воркер
+        weather = next_weather(doc.get("weather"))
+        await self.world.update_one({"_id": "clock"}, {"$set": {"weather": weather}})
+        return doc["tick"], weather
+
+    def _pipeline(self, tick: int, weather: str) -> list:
+        def decay(field: str, by: int):
+            value = {"$ifNull": [f"$game_data.{field}", SCALAR_FIELDS[field][1]]}
+            return {"$max": [0, {"$subtract": [value, by]}]}
+        return [{"$set": {
+            "game_data.weather": weather,
+            "game_data.hunger": decay("hunger", self.hunger_decay),
+            "game_data.thirst": decay("thirst", self.thirst_decay),
+            "game_data.world_tick": tick,
+            "v": {"$add": [{"$ifNull": ["$v", 0]}, 1]},
+        }}]
+
+    def _apply(self, game, tick: int, weather: str):
+        # Синхронно, без await: обработчики не увидят игру «наполовину» после тика
+        if game.world_tick >= tick:
+            return  # загружена из базы уже после тика
+        game.weather = weather
+        game.hunger = decayed(game.hunger, self.hunger_decay)
+        game.thirst = decayed(game.thirst, self.thirst_decay)
+        game.world_tick = tick
+        saved = game._saved
+        if saved is not None:
+            saved["weather"] = weather
+            saved["hunger"] = decayed(saved.get("hunger", SCALAR_FIELDS["hunger"][1]), self.hunger_decay)
+            saved["thirst"] = decayed(saved.get("thirst", SCALAR_FIELDS["thirst"][1]), self.thirst_decay)
+            saved["world_tick"] = tick
+        game._version += 1
+
+    async def tick(self) -> bool:
+        claimed = await self._claim()
+        if claimed is None:
+            return False
+        tick, weather = claimed
+        started = time.perf_counter()
+        async with self.pause_saves():
+            result = await self.players.update_many(
+                {"game_data": {"$exists": True}, "game_data.world_tick": {"$not": {"$gte": tick}}},
+                self._pipeline(tick, weather)
+            )
+            mirrored = {id(game): game for game in self.local_games()}
+            for game in mirrored.values():
+                self._apply(game, tick, weather)
+        elapsed = time.perf_counter() - started
+        MONGO_SECONDS.observe(elapsed, "world_tick")
+        self.ticks += 1
+        logging.info(f"Тик мира {tick}: погода {weather}, игроков {result.modified_count}, "
+                     f"в памяти {len(mirrored)}, {elapsed:.2f} сек")
+        return True
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Проверяем чаще интервала: аренда сама решит, чей сейчас тик
+        check_every = min(self.interval, 60.0)
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logging.error(f"Ошибка тика мира: {e}")
+            await asyncio.sleep(check_every)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None